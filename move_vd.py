@@ -4,7 +4,6 @@ DESC:   Move pipelines cognitivos de src/cog para src/ind e renomeia
         conforme a Ficha Mestre (VD-Âncora, VD-Nacional, VD-Capilaridade).
 """
 import os
-import shutil
 from pathlib import Path
 
 BASE_DIR = Path.cwd()
@@ -39,12 +38,11 @@ def main():
         # Verifica se a origem existe
         if src.exists():
             try:
-                # Se o destino já existe, avisa e sobrescreve
+                # Se o destino já existe, avisa; os.replace sobrescreve de forma atômica
                 if dst.exists():
                     print(f"   [!] Sobrescrevendo destino existente: {item['novo_nome']}")
-                    os.remove(dst)
                 
-                shutil.move(str(src), str(dst))
+                os.replace(src, dst)
                 print(f"✅ [SUCESSO] {item['desc']}")
                 print(f"   De: {item['nome_antigo']}")
                 print(f"   Para: {item['novo_nome']}")
@@ -22,7 +22,7 @@ import sys
 import time
 from pathlib import Path
 from datetime import datetime
-from scipy.stats import chi2, spearmanr, pearsonr, shapiro
+from scipy.stats import chi2, spearmanr, pearsonr, shapiro, rankdata
 
 # Tenta importar SKLEARN para PCA (Estatística Avançada)
 try:
@@ -41,11 +41,26 @@ try:
 except ImportError:
     HAS_DOCX = False
 
+# Tenta importar CALAMINE (leitor XLSX em Rust, bem mais rápido que o openpyxl)
+try:
+    import python_calamine
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+EXCEL_ENGINE = 'calamine' if HAS_CALAMINE else None
+
+# Tenta importar NUMBA (kernel compilado do W de Kendall)
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
 # --- CONFIGURAÇÃO ---
 TARGET_YEAR = "2015"
 BASE_DIR = Path(__file__).resolve().parent.parent.parent 
 DIRS = {
-    "csv":      BASE_DIR / "data" / "processed", / 'testes',
+    "csv":      BASE_DIR / "data" / "processed" / "testes",
     "xlsx":     BASE_DIR / "reports" / "varcog" / "xlsx",
     "graficos": BASE_DIR / "reports" / "varcog" / "graficos",
     "relatorios": BASE_DIR / "reports" / "varcog" / "relatorios"
@@ -118,7 +133,7 @@ def scan_files(target_suffix):
 def smart_load(files_dict, use_weighted=True):
     if not all(files_dict.values()): return None
     try:
-        def load(p): return pd.read_excel(p) if p.endswith("xlsx") else pd.read_csv(p)
+        def load(p): return pd.read_excel(p, engine=EXCEL_ENGINE) if p.endswith("xlsx") else pd.read_csv(p)
         df_p, df_s, df_e = load(files_dict["pisa"]), load(files_dict["saeb"]), load(files_dict["enem"])
         
         if 'Filtro' in df_e.columns:
@@ -146,14 +161,39 @@ def smart_load(files_dict, use_weighted=True):
     except Exception as e: print(f"[ERRO] {e}"); return None
 
 # 3. ANÁLISE BÁSICA
+def _w_kernel_numpy(ranks):
+    n, m = ranks.shape
+    S = ranks.sum(axis=1)
+    # UF com nota faltante tem S NaN e fica fora da soma (como o Series.sum() original)
+    return (12 * np.nansum((S - m * (n + 1) / 2) ** 2)) / (m ** 2 * (n ** 3 - n))
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _w_kernel(ranks):
+        """Soma dos desvios quadráticos das somas de rank numa única passada."""
+        n, m = ranks.shape
+        target = m * (n + 1) / 2
+        S = 0.0
+        for i in range(n):
+            s = 0.0
+            for j in range(m):
+                s += ranks[i, j]
+            if not np.isnan(s):
+                S += (s - target) ** 2
+        return 12 * S / (m * m * (n ** 3 - n))
+else:
+    _w_kernel = _w_kernel_numpy
+
+def kendall_w(mat):
+    """W de Kendall de uma matriz (n UFs x m avaliações): ranks decrescentes por coluna, empates pela média.
+    Nota faltante: só aquela célula fica NaN e as demais UFs da coluna são ranqueadas entre si."""
+    ranks = np.ascontiguousarray(rankdata(-mat, axis=0, nan_policy='omit'), dtype=np.float64)
+    return ranks, _w_kernel(ranks)
+
 def run_analysis(df):
-    df['R_PISA'] = df['PISA'].rank(ascending=False)
-    df['R_SAEB'] = df['SAEB'].rank(ascending=False)
-    df['R_ENEM'] = df['ENEM'].rank(ascending=False)
-    m = 3; n = len(df)
-    df['S'] = df['R_PISA'] + df['R_SAEB'] + df['R_ENEM']
-    S_var = ((df['S'] - (m*(n+1)/2))**2).sum()
-    W = (12 * S_var) / (m**2 * (n**3 - n))
+    ranks, W = kendall_w(df[['PISA', 'SAEB', 'ENEM']].to_numpy(dtype=float))
+    df['R_PISA'], df['R_SAEB'], df['R_ENEM'] = ranks.T
+    df['S'] = ranks.sum(axis=1)
     
     df['Rank_Consenso'] = df['S'].rank(method='min')
     df['Desvio_Rank'] = df[['R_PISA', 'R_SAEB', 'R_ENEM']].std(axis=1)
@@ -206,7 +246,7 @@ def plot_results(df, W, suffix):
     xs, ys, zs = df['SAEB'], df['ENEM'], df['PISA']
     ax.scatter(xs, ys, zs, c=df['S'], cmap='RdYlGn_r', s=60, depthshade=True, edgecolors='k')
     for x, y, z, s in zip(xs, ys, zs, df['S']): ax.plot([x, x], [y, y], [zs.min()*0.95, z], 'k--', alpha=0.2, linewidth=0.5)
-    for i, txt in enumerate(df['UF']): ax.text(xs[i], ys[i], zs[i], txt, fontsize=7)
+    for x, y, z, txt in zip(xs.to_numpy(), ys.to_numpy(), zs.to_numpy(), df['UF'].to_numpy()): ax.text(x, y, z, txt, fontsize=7)
     ax.set_xlabel('SAEB'); ax.set_ylabel('ENEM'); ax.set_zlabel('PISA'); ax.view_init(elev=20, azim=-45)
     plt.savefig(DIRS["graficos"] / f"kendall_2015_3d{suffix}.png", dpi=150); plt.close()
 
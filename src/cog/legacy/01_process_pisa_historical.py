@@ -18,16 +18,19 @@ ABSTRACT:
       ensuring the positional extraction (Region slicing) works correctly.
 
 DEPENDENCIES:
-    pandas, numpy, pyreadstat, openpyxl, re
+    pandas, numpy, pyreadstat, polars, openpyxl, re
 ================================================================================
 """
 
-import pandas as pd
 import numpy as np
+import polars as pl
 import os
+import re
 import sys
 import time
+import multiprocessing as mp
 import pyreadstat
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import timedelta
 
@@ -43,6 +46,9 @@ XLSX_OUT_DIR = REPORT_DIR / 'xlsx'
 for path in [CSV_OUT_DIR, XLSX_OUT_DIR]:
     path.mkdir(parents=True, exist_ok=True)
 
+# Worker processes for pyreadstat's parallel SAV parse
+READ_PROCESSES = max(2, (os.cpu_count() or 2) // 2)
+
 # SafeGuard Import (Active only for 2015)
 script_dir = os.path.dirname(os.path.abspath(__file__))
 lib_path = os.path.join(script_dir, 'lib')
@@ -63,6 +69,30 @@ class ExecutionTimer:
         self.interval = time.perf_counter() - self.start
         print(f"[TIMER] Execution time: {str(timedelta(seconds=self.interval))}")
 
+def summarize_regions(df, brazil, region_expr):
+    """
+    Lazy Polars plan: Brazil filter -> region decode -> counts/means -> global mean.
+    Rows that fail to decode stay in an 'UNKNOWN' group so the caller can report them;
+    the whole chain runs in a single collect().
+    """
+    return (
+        pl.from_pandas(df).lazy()
+        .filter(pl.col('CNT').is_in(brazil))
+        .with_columns(region_expr.alias('Region'))
+        .group_by('Region')
+        .agg(pl.len().alias('Student_Count'),
+             pl.col('PV1MATH').mean().alias('Math_Mean'),
+             pl.col('PV1READ').mean().alias('Read_Mean'),
+             pl.col('PV1SCIE').mean().alias('Science_Mean'))
+        .with_columns(((pl.col('Math_Mean') + pl.col('Read_Mean') + pl.col('Science_Mean')) / 3).alias('Cognitive_Global_Mean'))
+        .collect()
+    )
+
+def finalize_regions(res):
+    """Drops the 'UNKNOWN' group, rounds and ranks by Cognitive_Global_Mean (pandas frame for export)."""
+    return (res.filter(pl.col('Region') != 'UNKNOWN').with_columns(pl.exclude('Region', 'Student_Count').round(2))
+            .sort('Cognitive_Global_Mean', descending=True, nulls_last=True).to_pandas())
+
 # --- 3. CORE ETL CLASS ---
 
 class PisaUnifiedETL:
@@ -80,7 +110,9 @@ class PisaUnifiedETL:
         base_path = DATA_RAW_ROOT / 'pisa_2015'
         if not base_path.exists(): print(f"[ERROR] Path missing: {base_path}"); return
 
-        sav_files = [f for f in os.listdir(base_path) if 'STU' in f and f.endswith('.sav')]
+        # scandir: one pass, file type comes cached on the DirEntry; sorted so the pick is deterministic
+        with os.scandir(base_path) as it:
+            sav_files = sorted(e.name for e in it if e.is_file() and 'STU' in e.name and e.name.endswith('.sav'))
         if not sav_files: print("[CRITICAL] No .sav file found."); return
 
         target_file = base_path / sav_files[0]
@@ -102,13 +134,8 @@ class PisaUnifiedETL:
         IBGE_TO_REGION = {code: reg for reg, codes in REGIONAL_MAP.items() for code in codes}
         IBGE_TO_SIGLA = {11:'RO', 12:'AC', 13:'AM', 14:'RR', 15:'PA', 16:'AP', 17:'TO', 21:'MA', 22:'PI', 23:'CE', 24:'RN', 25:'PB', 26:'PE', 27:'AL', 28:'SE', 29:'BA', 31:'MG', 32:'ES', 33:'RJ', 35:'SP', 41:'PR', 42:'SC', 43:'RS', 50:'MS', 51:'MT', 52:'GO', 53:'DF'}
 
-        def resolve_ibge_from_text(text_label):
-            if not isinstance(text_label, str): return None
-            text_upper = text_label.upper()
-            sorted_names = sorted(NAME_TO_IBGE.keys(), key=len, reverse=True)
-            for name in sorted_names:
-                if name in text_upper: return NAME_TO_IBGE[name]
-            return None
+        # One alternation, longest names first ('MATO GROSSO DO SUL' before 'MATO GROSSO')
+        name_pattern = '(' + '|'.join(re.escape(n) for n in sorted(NAME_TO_IBGE, key=len, reverse=True)) + ')'
 
         try:
             _, meta = pyreadstat.read_sav(str(target_file), metadataonly=True)
@@ -131,20 +158,25 @@ class PisaUnifiedETL:
             else:
                 df['STRATUM_TEXT'] = df[region_col].astype(str)
 
-            df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(resolve_ibge_from_text)
-            print(f"[STATS] Mapped Rows: {df['IBGE_CODE'].notnull().sum()}/{len(df)}")
-            
-            df = df.dropna(subset=['IBGE_CODE'])
-            if 'PV1MATH' in df.columns: df['Math'] = df['PV1MATH']
-            if 'PV1READ' in df.columns: df['Read'] = df['PV1READ']
-            if 'PV1SCIE' in df.columns: df['Science'] = df['PV1SCIE']
-
-            summary = df.groupby('IBGE_CODE')[['Math', 'Read', 'Science']].mean().reset_index()
-            summary['UF'] = summary['IBGE_CODE'].map(IBGE_TO_SIGLA)
-            summary['Region'] = summary['IBGE_CODE'].map(IBGE_TO_REGION)
-            summary['Cognitive_Global_Mean'] = summary[['Math', 'Read', 'Science']].mean(axis=1)
-            summary = summary.sort_values('Cognitive_Global_Mean', ascending=False)
-            summary = summary[['Region', 'UF', 'Math', 'Read', 'Science', 'Cognitive_Global_Mean']]
+            # Decode -> group -> derive -> rank as one lazy Polars plan, run by a single collect()
+            summary = (
+                pl.from_pandas(df[['STRATUM_TEXT', 'PV1MATH', 'PV1READ', 'PV1SCIE']]).lazy()
+                .with_columns(pl.col('STRATUM_TEXT').str.to_uppercase().str.extract(name_pattern, 1)
+                              .replace_strict(NAME_TO_IBGE, default=None, return_dtype=pl.Int64).alias('IBGE_CODE'))
+                .filter(pl.col('IBGE_CODE').is_not_null())
+                .group_by('IBGE_CODE')
+                .agg(pl.len().alias('Mapped'),
+                     pl.col('PV1MATH').mean().alias('Math'),
+                     pl.col('PV1READ').mean().alias('Read'),
+                     pl.col('PV1SCIE').mean().alias('Science'))
+                .with_columns(pl.col('IBGE_CODE').replace_strict(IBGE_TO_SIGLA, default=None, return_dtype=pl.Utf8).alias('UF'),
+                              pl.col('IBGE_CODE').replace_strict(IBGE_TO_REGION, default=None, return_dtype=pl.Utf8).alias('Region'),
+                              pl.mean_horizontal('Math', 'Read', 'Science').alias('Cognitive_Global_Mean'))
+                .sort('Cognitive_Global_Mean', descending=True, nulls_last=True)
+                .collect()
+            )
+            print(f"[STATS] Mapped Rows: {summary['Mapped'].sum()}/{len(df)}")
+            summary = summary.select(['Region', 'UF', 'Math', 'Read', 'Science', 'Cognitive_Global_Mean']).to_pandas()
 
             if DataGuard:
                 print("[AUDIT] Verifying Consistency...")
@@ -155,7 +187,7 @@ class PisaUnifiedETL:
             out_csv = CSV_OUT_DIR / 'pisa_2015_states.csv'
             out_xlsx = XLSX_OUT_DIR / 'pisa_2015_states.xlsx'
             summary.to_csv(out_csv, index=False)
-            summary.to_excel(out_xlsx, index=False)
+            summary.to_excel(out_xlsx, index=False, engine='xlsxwriter')
             print(f"[SUCCESS] Saved: {out_csv.name}")
 
         except Exception as e:
@@ -178,58 +210,46 @@ class PisaUnifiedETL:
         cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE']
         
         try:
-            # FIX: convert_categoricals=False forces pandas to read 'BRA0206' instead of the label
-            df = pd.read_spss(str(RAW_FILE), usecols=cols, convert_categoricals=False)
+            # FIX: raw values (no value labels applied) keep 'BRA0206' instead of the label
+            # read_file_multiprocessing: the .sav is parsed in row slices across worker processes
+            df, _ = pyreadstat.read_file_multiprocessing(
+                pyreadstat.read_sav, str(RAW_FILE), usecols=cols, num_processes=READ_PROCESSES,
+                disable_datetime_conversion=True)
             
             # Filter Brazil (Handles 'BRA' string or 76 numeric)
-            df = df[df['CNT'].astype(str).str.contains('BRA|Brazil|76', case=False, na=False)].copy()
-            print(f"      - Brazil rows found: {len(df)}")
-            
-            if len(df) == 0: print("[ERROR] No Brazil rows found."); return
+            # CNT has a handful of distinct codes: match the pattern on those, then filter with isin
+            brazil = [v for v in df['CNT'].dropna().unique() if re.search('BRA|Brazil|76', str(v), re.IGNORECASE)]
 
             # --- 2018 LOGIC: STRATUM DIGITS ---
-            def get_region_code_2018(stratum):
-                s = str(stratum).upper().strip()
-                if s.startswith('BRA'):
-                    # PISA 2018: BRA + Region(2) + Stratum(2)
-                    # Extract positions 3 and 4 (0-based) -> BRA(012) XX(34)
-                    code = s[3:5] 
-                    if code == '01': return 'North'
-                    if code == '02': return 'Northeast'
-                    if code == '03': return 'Southeast'
-                    if code == '04': return 'South'
-                    if code == '05': return 'Center-West'
-                return 'UNKNOWN'
+            # PISA 2018: BRA + Region(2) + Stratum(2)
+            # Extract positions 3 and 4 (0-based) -> BRA(012) XX(34), for the whole column at once
+            region_codes = {'01': 'North', '02': 'Northeast', '03': 'Southeast', '04': 'South', '05': 'Center-West'}
 
             print("[INFO] Decoding Regions from numeric Stratum...")
-            df['Region'] = df['STRATUM'].apply(get_region_code_2018)
-            
+            s = pl.col('STRATUM').cast(pl.Utf8).str.to_uppercase().str.strip_chars()
+            region = (pl.when(s.str.starts_with('BRA')).then(s.str.slice(3, 2))
+                      .replace_strict(region_codes, default='UNKNOWN', return_dtype=pl.Utf8).fill_null('UNKNOWN'))
+            res = summarize_regions(df, brazil, region)
+
+            total = res['Student_Count'].sum()
+            print(f"      - Brazil rows found: {total}")
+            if total == 0: print("[ERROR] No Brazil rows found."); return
+
             # Validation
-            unknowns = len(df[df['Region'] == 'UNKNOWN'])
-            valid = len(df[df['Region'] != 'UNKNOWN'])
+            valid = res.filter(pl.col('Region') != 'UNKNOWN')['Student_Count'].sum()
             print(f"[STATS] Valid Regional Rows: {valid}")
             
             if valid == 0:
                 print("[CRITICAL] Region mapping failed. Checking Stratum sample:")
-                print(df['STRATUM'].head().tolist())
+                print(df.loc[df['CNT'].isin(brazil), 'STRATUM'].head().tolist())
                 return
 
-            df = df[df['Region'] != 'UNKNOWN']
-            
-            means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
-            counts = df['Region'].value_counts().reset_index()
-            counts.columns = ['Region', 'Student_Count']
-            
-            res = pd.merge(counts, means, on='Region')
-            res['Cognitive_Global_Mean'] = (res['PV1MATH'] + res['PV1READ'] + res['PV1SCIE']) / 3
-            res = res.rename(columns={'PV1MATH': 'Math_Mean', 'PV1READ': 'Read_Mean', 'PV1SCIE': 'Science_Mean'})
-            
-            df_final = res.round(2).sort_values('Cognitive_Global_Mean', ascending=False)
+            df_final = finalize_regions(res)
             
             csv_path = CSV_OUT_DIR / 'pisa_2018_regional_summary.csv'
             xlsx_path = XLSX_OUT_DIR / 'pisa_2018_regional_summary.xlsx'
             df_final.to_csv(csv_path, index=False)
-            df_final.to_excel(xlsx_path, index=False)
+            df_final.to_excel(xlsx_path, index=False, engine='xlsxwriter')
             print(f"[SUCCESS] Saved: {csv_path.name}")
 
         except Exception as e:
@@ -252,41 +272,40 @@ class PisaUnifiedETL:
         cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE']
         
         try:
-            # 2022 is usually safer with default categoricals due to text matching
-            df = pd.read_spss(str(RAW_FILE), usecols=cols)
-            df = df[df['CNT'].astype(str).str.contains('Brazil|BRA', case=False, na=False)].copy()
-            print(f"      - Brazil rows found: {len(df)}")
-            
-            if len(df) == 0: print("[ERROR] No Brazil rows found."); return
+            # 2022 matches on label text: read raw codes in parallel and apply the labels
+            # only where needed (distinct CNT codes, then the Brazil STRATUM rows)
+            df, meta = pyreadstat.read_file_multiprocessing(
+                pyreadstat.read_sav, str(RAW_FILE), usecols=cols, num_processes=READ_PROCESSES,
+                disable_datetime_conversion=True)
+            cnt_labels = meta.variable_value_labels.get('CNT', {})
+            brazil = [v for v in df['CNT'].dropna().unique() if re.search('Brazil|BRA', str(cnt_labels.get(v, v)), re.IGNORECASE)]
+            strat_labels = meta.variable_value_labels.get('STRATUM')
 
             # --- 2022 LOGIC: TEXT MATCHING ---
-            def get_region_2022(stratum):
-                s = str(stratum).upper()
-                if 'CENTRO-OESTE' in s or 'CENTRO OESTE' in s: return 'Center-West'
-                if 'NORDESTE' in s: return 'Northeast'
-                if 'SUDESTE' in s: return 'Southeast'
-                if 'NORTE' in s: return 'North'
-                if 'SUL' in s: return 'South'
-                return 'UNKNOWN'
-
+            # Labels applied inside the plan; the first matching condition wins, in this priority order
             print("[INFO] Aggregating by Macro-Region (Text Match)...")
-            df['Region'] = df['STRATUM'].apply(get_region_2022)
-            df = df[df['Region'] != 'UNKNOWN']
-            
-            means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
-            counts = df['Region'].value_counts().reset_index()
-            counts.columns = ['Region', 'Student_Count']
-            
-            res = pd.merge(counts, means, on='Region')
-            res['Cognitive_Global_Mean'] = (res['PV1MATH'] + res['PV1READ'] + res['PV1SCIE']) / 3
-            res = res.rename(columns={'PV1MATH': 'Math_Mean', 'PV1READ': 'Read_Mean', 'PV1SCIE': 'Science_Mean'})
-            
-            df_final = res.round(2).sort_values('Cognitive_Global_Mean', ascending=False)
+            stratum = pl.col('STRATUM').cast(pl.Utf8)
+            if strat_labels:
+                stratum = pl.col('STRATUM').replace_strict(strat_labels, default=stratum, return_dtype=pl.Utf8)
+            s = stratum.str.to_uppercase()
+            region = (pl.when(s.str.contains('CENTRO-OESTE|CENTRO OESTE')).then(pl.lit('Center-West'))
+                      .when(s.str.contains('NORDESTE', literal=True)).then(pl.lit('Northeast'))
+                      .when(s.str.contains('SUDESTE', literal=True)).then(pl.lit('Southeast'))
+                      .when(s.str.contains('NORTE', literal=True)).then(pl.lit('North'))
+                      .when(s.str.contains('SUL', literal=True)).then(pl.lit('South'))
+                      .otherwise(pl.lit('UNKNOWN')))
+            res = summarize_regions(df, brazil, region)
+
+            total = res['Student_Count'].sum()
+            print(f"      - Brazil rows found: {total}")
+            if total == 0: print("[ERROR] No Brazil rows found."); return
+
+            df_final = finalize_regions(res)
             
             csv_path = CSV_OUT_DIR / 'pisa_2022_regional_summary.csv'
             xlsx_path = XLSX_OUT_DIR / 'pisa_2022_regional_summary.xlsx'
             df_final.to_csv(csv_path, index=False)
-            df_final.to_excel(xlsx_path, index=False)
+            df_final.to_excel(xlsx_path, index=False, engine='xlsxwriter')
             print(f"[SUCCESS] Saved: {csv_path.name}")
 
         except Exception as e:
@@ -294,6 +313,14 @@ class PisaUnifiedETL:
 
 # --- 4. EXECUTION FLOW ---
 
+def run_year(year):
+    """Runs one cycle (module-level so ProcessPoolExecutor can pickle it)."""
+    etl = PisaUnifiedETL()
+    with ExecutionTimer():
+        if year == '2015': etl.run_2015()
+        elif year == '2018': etl.run_2018()
+        elif year == '2022': etl.run_2022()
+
 def main():
     print("="*60)
     print("      COGNITIVE CAPITAL - PISA ETL (v7.1 Fix)")
@@ -307,7 +334,6 @@ def main():
         choice = input("Select Year or press ENTER for ALL: ").strip().lower()
 
     # 2. Resolve Targets (Logic: Empty input = Process ALL immediately)
-    etl = PisaUnifiedETL()
     targets = []
     
     if not choice or choice in ['all', 'todos']:
@@ -319,12 +345,12 @@ def main():
     else:
         print("[ERROR] Invalid selection."); sys.exit(1)
 
-    # 3. Execute
-    for year in targets:
-        with ExecutionTimer():
-            if year == '2015': etl.run_2015()
-            elif year == '2018': etl.run_2018()
-            elif year == '2022': etl.run_2022()
+    # 3. Execute (independent files and outputs: one process per cycle)
+    if len(targets) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(targets), os.cpu_count() or 1), mp_context=mp.get_context('spawn')) as ex:
+            list(ex.map(run_year, targets))
+    else:
+        for year in targets: run_year(year)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -25,6 +25,14 @@ import matplotlib.pyplot as plt
 from scipy.stats import zscore
 from pathlib import Path
 
+# Optional fast XLSX reader (Rust-backed calamine); falls back to pandas' default engine
+try:
+    import python_calamine
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+EXCEL_ENGINE = 'calamine' if HAS_CALAMINE else None
+
 # --- CONFIGURATION ---
 sns.set_theme(style="whitegrid")
 plt.rcParams['figure.dpi'] = 300
@@ -60,7 +68,7 @@ def load_and_prep_data():
     if not FILE_ENEM.exists():
         print(f"[ERROR] File not found: {FILE_ENEM}")
         return None
-    df_enem = pd.read_excel(FILE_ENEM)
+    df_enem = pd.read_excel(FILE_ENEM, engine=EXCEL_ENGINE)
     # Aggregate to Region Mean
     df_enem_reg = df_enem.groupby('Region')['Triennium_Mean'].mean().reset_index().rename(columns={'Triennium_Mean': 'ENEM_Score'})
 
@@ -85,11 +93,12 @@ def plot_scatter(df):
     )
     
     # Annotate Regions
-    for i, row in df.iterrows():
+    xs = df['PISA_Score'].to_numpy(); ys = df['ENEM_Score'].to_numpy(); labels = df['Region'].to_numpy()
+    for x, y, label in zip(xs, ys, labels):
         plt.text(
-            row['PISA_Score'] + 1.5, 
-            row['ENEM_Score'], 
-            row['Region'], 
+            x + 1.5, 
+            y, 
+            label, 
             fontsize=11, 
             fontweight='bold', 
             color='#34495e'
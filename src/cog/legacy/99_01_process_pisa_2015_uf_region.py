@@ -82,13 +82,8 @@ IBGE_TO_SIGLA = {
     50:'MS', 51:'MT', 52:'GO', 53:'DF'
 }
 
-def resolve_ibge_from_text(text_label):
-    if not isinstance(text_label, str): return None
-    text_upper = text_label.upper()
-    sorted_names = sorted(NAME_TO_IBGE.keys(), key=len, reverse=True)
-    for name in sorted_names:
-        if name in text_upper: return NAME_TO_IBGE[name]
-    return None
+# One alternation, longest names first ('MATO GROSSO DO SUL' before 'MATO GROSSO')
+IBGE_NAME_PATTERN = '(' + '|'.join(re.escape(n) for n in sorted(NAME_TO_IBGE, key=len, reverse=True)) + ')'
 
 def process_pisa_2015():
     print("="*60)
@@ -99,7 +94,9 @@ def process_pisa_2015():
         print(f"[ERROR] Directory missing: {DATA_RAW}")
         return
 
-    sav_files = [f for f in os.listdir(DATA_RAW) if 'STU' in f and f.endswith('.sav')]
+    # scandir: one pass, file type comes cached on the DirEntry; sorted so the pick is deterministic
+    with os.scandir(DATA_RAW) as it:
+        sav_files = sorted(e.name for e in it if e.is_file() and 'STU' in e.name and e.name.endswith('.sav'))
     if not sav_files:
         print("[CRITICAL] No Student (STU) file found.")
         return
@@ -138,7 +135,7 @@ def process_pisa_2015():
             df['STRATUM_TEXT'] = df[region_col].astype(str)
 
         # Geocoding
-        df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(resolve_ibge_from_text)
+        df['IBGE_CODE'] = df['STRATUM_TEXT'].str.upper().str.extract(IBGE_NAME_PATTERN, expand=False).map(NAME_TO_IBGE)
         valid_rows = df['IBGE_CODE'].notnull().sum()
         print(f"[STATS] Mapped Rows: {valid_rows}/{len(df)}")
         
@@ -176,7 +173,7 @@ def process_pisa_2015():
         out_xlsx = os.path.join(XLSX_DIR, 'pisa_2015_states.xlsx')
         
         summary.to_csv(out_csv, index=False)
-        summary.to_excel(out_xlsx, index=False)
+        summary.to_excel(out_xlsx, index=False, engine='xlsxwriter')
         
         print(f"[SUCCESS] Reports Generated:")
         print(f"          CSV:  {out_csv}")
@@ -25,9 +25,10 @@ DATA SOURCE CITATION:
     DOI:        10.5281/zenodo.13383115
     URL:        https://zenodo.org/records/13383115
 """
-import pandas as pd
 import numpy as np
 import os
+import re
+import pyreadstat
 from pathlib import Path
 
 # --- CONFIGURATION ---
@@ -80,14 +81,17 @@ def process_pisa_2015():
     cols = ['CNT', 'STRATUM', 'SUBNATIO', 'PV1MATH', 'PV1READ', 'PV1SCIE']
     
     try:
-        # Load data (convert_categoricals=False helps read raw codes if needed, 
-        # but 2015 usually works well with default if we look for strings)
-        df = pd.read_spss(RAW_FILE, usecols=cols)
+        # Load data with value labels applied (the matching below looks for strings);
+        # pyreadstat directly parses the file in parallel
+        df, _ = pyreadstat.read_file_multiprocessing(
+            pyreadstat.read_sav, str(RAW_FILE), usecols=cols, apply_value_formats=True,
+            formats_as_category=True, num_processes=max(2, (os.cpu_count() or 2) // 2),
+            disable_datetime_conversion=True)
         
         # --- ROBUST FILTERING ---
-        # Convert CNT to string and look for 'Brazil' or 'BRA'
-        mask = df['CNT'].astype(str).str.contains('Brazil|BRA', case=False, na=False)
-        df = df[mask].copy()
+        # Look for 'Brazil' or 'BRA' among the distinct CNT codes only, then filter with isin
+        brazil = [v for v in df['CNT'].dropna().unique() if re.search('Brazil|BRA', str(v), re.IGNORECASE)]
+        df = df[df['CNT'].isin(brazil)].copy()
         
         print(f"       - Brazil rows found: {len(df)}")
         if len(df) == 0:
@@ -151,7 +155,7 @@ if __name__ == "__main__":
         
         if df_final is not None and not df_final.empty:
             df_final.to_csv(PATH_CSV, index=False)
-            df_final.to_excel(PATH_XLSX, index=False)
+            df_final.to_excel(PATH_XLSX, index=False, engine='xlsxwriter')
             print(f"[SUCCESS] CSV Saved: {PATH_CSV}")
             print(f"[SUCCESS] Excel Saved: {PATH_XLSX}")
             print("\n--- FIRST 10 ROWS (Sorted by Score) ---")
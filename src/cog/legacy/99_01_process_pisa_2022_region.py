@@ -39,9 +39,12 @@ DEPENDENCIES:
 import pandas as pd
 import numpy as np
 import os
+import re
 import sys
 import time
+import multiprocessing as mp
 import pyreadstat
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import timedelta
 
@@ -55,6 +58,11 @@ REPORT_DIR = PROJECT_ROOT / 'reports' / 'varcog' / 'xlsx'
 for path in [DATA_PROCESSED_DIR, REPORT_DIR]:
     path.mkdir(parents=True, exist_ok=True)
 
+# Worker processes for pyreadstat's parallel SAV parse
+READ_PROCESSES = max(2, (os.cpu_count() or 2) // 2)
+PISA_COLS = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE']
+SAV_CHUNK_ROWS = 200_000
+
 # --- 2. EXPLICIT MAPPING DICTIONARIES ---
 NAME_TO_IBGE = {
     'RONDONIA': 11, 'RONDÔNIA': 11, 'ACRE': 12, 'AMAZONAS': 13, 'RORAIMA': 14,
@@ -67,8 +75,24 @@ NAME_TO_IBGE = {
     'PARANA': 41, 'PARANÁ': 41, 'SANTA CATARINA': 42, 'RIO GRANDE DO SUL': 43,
     'MATO GROSSO DO SUL': 50, 'MATO GROSSO': 51, 'GOIAS': 52, 'GOIÁS': 52, 'DISTRITO FEDERAL': 53
 }
+# One alternation, longest names first ('MATO GROSSO DO SUL' before 'MATO GROSSO')
+IBGE_NAME_PATTERN = '(' + '|'.join(re.escape(n) for n in sorted(NAME_TO_IBGE, key=len, reverse=True)) + ')'
+REGIONS = ['North', 'Northeast', 'Southeast', 'South', 'Center-West']
 IBGE_TO_SIGLA = {11:'RO', 12:'AC', 13:'AM', 14:'RR', 15:'PA', 16:'AP', 17:'TO', 21:'MA', 22:'PI', 23:'CE', 24:'RN', 25:'PB', 26:'PE', 27:'AL', 28:'SE', 29:'BA', 31:'MG', 32:'ES', 33:'RJ', 35:'SP', 41:'PR', 42:'SC', 43:'RS', 50:'MS', 51:'MT', 52:'GO', 53:'DF'}
 
+def read_brazil_rows(file_path, is_brazil):
+    """Reads PISA_COLS in chunks and keeps only the Brazil rows of each one, so peak memory is one chunk
+    plus the Brazil subset instead of the whole worldwide file. is_brazil(code, cnt_labels) runs on the
+    distinct CNT codes of a chunk only."""
+    parts, meta = [], None
+    for chunk, meta in pyreadstat.read_file_in_chunks(
+            pyreadstat.read_sav, str(file_path), chunksize=SAV_CHUNK_ROWS, usecols=PISA_COLS,
+            multiprocess=True, num_processes=READ_PROCESSES, disable_datetime_conversion=True):
+        cnt_labels = meta.variable_value_labels.get('CNT', {})
+        brazil = [v for v in chunk['CNT'].dropna().unique() if is_brazil(v, cnt_labels)]
+        parts.append(chunk[chunk['CNT'].isin(brazil)])
+    return pd.concat(parts, ignore_index=True), meta
+
 # --- 3. ETL CORE CLASS ---
 class PisaUnifiedETL:
     
@@ -79,13 +103,12 @@ class PisaUnifiedETL:
         if not target_file: 
             print("[ERROR] 2015 raw file not found."); return
 
-        df, meta = pyreadstat.read_sav(str(target_file))
-        df = df[df['CNT'] == 'BRA'].copy()
+        df, meta = read_brazil_rows(target_file, lambda v, _: v == 'BRA')
         labels = meta.variable_value_labels.get('STRATUM', {})
         df['STRATUM_TEXT'] = df['STRATUM'].map(labels).fillna(df['STRATUM'].astype(str))
         
         # Mapping logic
-        df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(lambda x: next((NAME_TO_IBGE[n] for n in sorted(NAME_TO_IBGE.keys(), key=len, reverse=True) if n in str(x).upper()), None))
+        df['IBGE_CODE'] = df['STRATUM_TEXT'].astype(str).str.upper().str.extract(IBGE_NAME_PATTERN, expand=False).map(NAME_TO_IBGE)
         df = df.dropna(subset=['IBGE_CODE'])
         
         summary = df.groupby('IBGE_CODE')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
@@ -96,7 +119,7 @@ class PisaUnifiedETL:
         
         # Final Exports
         df_final.to_csv(DATA_PROCESSED_DIR / 'pisa_2015_states.csv', index=False)
-        df_final.to_excel(REPORT_DIR / 'pisa_2015_states.xlsx', index=False)
+        df_final.to_excel(REPORT_DIR / 'pisa_2015_states.xlsx', index=False, engine='xlsxwriter')
         print("[SUCCESS] Exported PISA 2015.")
 
     def run_2018(self):
@@ -105,15 +128,17 @@ class PisaUnifiedETL:
         if not file_path.exists(): 
             print("[ERROR] 2018 raw file not found."); return
 
-        df = pd.read_spss(str(file_path), usecols=['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE'], convert_categoricals=False)
-        df = df[df['CNT'].astype(str).str.contains('BRA|76')].copy()
+        # Raw codes (no value labels) keep 'BRAxxxx' in STRATUM; pattern checked on the distinct CNT codes only
+        df, _ = read_brazil_rows(file_path, lambda v, _: re.search('BRA|76', str(v)))
         
-        mapping = {'01':'North', '02':'Northeast', '03':'Southeast', '04':'South', '05':'Center-West'}
-        df['Region'] = df['STRATUM'].apply(lambda x: mapping.get(str(x).upper()[3:5], 'UNKNOWN'))
-        df = df[df['Region'] != 'UNKNOWN']
+        # Region code (chars 4-5) -> small int -> Categorical (1 byte per row instead of a string)
+        lut = pd.Series({'01': 0, '02': 1, '03': 2, '04': 3, '05': 4})
+        ids = df['STRATUM'].astype(str).str.slice(3, 5).map(lut)
+        df = df.loc[ids.notna()].copy()
+        df['Region'] = pd.Categorical.from_codes(ids[ids.notna()].astype(np.int8).to_numpy(), categories=REGIONS)
         
-        means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
-        counts = df.groupby('Region').size().reset_index(name='Student_Count')
+        means = df.groupby('Region', observed=True)[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
+        counts = df.groupby('Region', observed=True).size().reset_index(name='Student_Count')
         
         res = pd.merge(counts, means, on='Region')
         res['Cognitive_Global_Mean'] = res[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean(axis=1)
@@ -121,7 +146,7 @@ class PisaUnifiedETL:
         
         # Final Exports
         df_final.to_csv(DATA_PROCESSED_DIR / 'pisa_2018_regional_summary.csv', index=False)
-        df_final.to_excel(REPORT_DIR / 'pisa_2018_regional_summary.xlsx', index=False)
+        df_final.to_excel(REPORT_DIR / 'pisa_2018_regional_summary.xlsx', index=False, engine='xlsxwriter')
         print("[SUCCESS] Exported PISA 2018.")
 
     def run_2022(self):
@@ -130,14 +155,15 @@ class PisaUnifiedETL:
         if not file_path.exists(): 
             print("[ERROR] 2022 raw file not found."); return
 
-        df = pd.read_spss(str(file_path), usecols=['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE'])
-        df = df[df['CNT'].astype(str).str.contains('Brazil')].copy()
-        
-        def get_reg(s):
-            s = str(s).upper()
-            return 'North' if 'NORTE' in s else 'Northeast' if 'NORDESTE' in s else 'Southeast' if 'SUDESTE' in s else 'South' if 'SUL' in s else 'Center-West' if 'CENTRO' in s else 'UNKNOWN'
+        # Raw codes; labels are applied only to the distinct CNT codes and the Brazil STRATUM rows
+        df, meta = read_brazil_rows(file_path, lambda v, cnt_labels: 'Brazil' in str(cnt_labels.get(v, v)))
+        strat_labels = meta.variable_value_labels.get('STRATUM')
+        if strat_labels: df['STRATUM'] = df['STRATUM'].map(strat_labels).fillna(df['STRATUM'])
         
-        df['Region'] = df['STRATUM'].apply(get_reg)
+        # Same priority as the old per-row chain: np.select keeps the first matching condition
+        s = df['STRATUM'].astype(str).str.upper()
+        conds = [s.str.contains(k, regex=False) for k in ['NORTE', 'NORDESTE', 'SUDESTE', 'SUL', 'CENTRO']]
+        df['Region'] = np.select(conds, ['North', 'Northeast', 'Southeast', 'South', 'Center-West'], default='UNKNOWN')
         df = df[df['Region'] != 'UNKNOWN']
         
         means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
@@ -149,10 +175,14 @@ class PisaUnifiedETL:
         
         # Final Exports
         df_final.to_csv(DATA_PROCESSED_DIR / 'pisa_2022_regional_summary.csv', index=False)
-        df_final.to_excel(REPORT_DIR / 'pisa_2022_regional_summary.xlsx', index=False)
+        df_final.to_excel(REPORT_DIR / 'pisa_2022_regional_summary.xlsx', index=False, engine='xlsxwriter')
         print("[SUCCESS] Exported PISA 2022.")
 
 # --- 4. EXECUTION FLOW ---
+def run_cycle(method):
+    """Runs one PisaUnifiedETL cycle by method name (module-level so ProcessPoolExecutor can pickle it)."""
+    getattr(PisaUnifiedETL(), method)()
+
 def main():
     print("="*60 + "\n   COGNITIVE CAPITAL - PISA ETL PRODUCTION (v8.0)\n" + "="*60)
     print("Warning: Processing large SPSS (.sav) files may take several minutes.\n")
@@ -165,13 +195,16 @@ def main():
     choice = input("\nSelect an option (1-4 or Q): ").strip().upper()
     if choice == 'Q': sys.exit(0)
     
-    etl = PisaUnifiedETL()
+    jobs = [m for opt, m in [('1', 'run_2015'), ('2', 'run_2018'), ('3', 'run_2022')] if choice in [opt, '4']]
     start = time.perf_counter()
     
     try:
-        if choice in ['1', '4']: etl.run_2015()
-        if choice in ['2', '4']: etl.run_2018()
-        if choice in ['3', '4']: etl.run_2022()
+        # Cycles read and write separate files: ALL runs them in parallel processes
+        if len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1), mp_context=mp.get_context('spawn')) as ex:
+                list(ex.map(run_cycle, jobs))
+        else:
+            for job in jobs: run_cycle(job)
         print(f"\n[TIMER] Finished in: {str(timedelta(seconds=time.perf_counter() - start))}")
     except Exception as e:
         print(f"\n[ERROR] {e}")
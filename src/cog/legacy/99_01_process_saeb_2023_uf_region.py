@@ -19,15 +19,19 @@ INPUT:
 OUTPUT:
     - data/processed/saeb_table_2023.csv
     - reports/varcog/xlsx/saeb_table_2023.xlsx
+    - reports/varcog/graficos/ranking_saeb_2023.png (only with --plot)
 """
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import os
 import sys
 import zipfile
-import matplotlib.pyplot as plt
-import seaborn as sns
+import argparse
+import multiprocessing as mp
+from pathlib import Path
 
 # --- 1. SAFEGUARD IMPORT PROTOCOL ---
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -39,16 +43,20 @@ try:
 except ImportError:
     DataGuard = None
 
+# Shared aggregation kernel (src/ind/lib; numba stays optional in there)
+ind_lib_path = os.path.join(os.path.dirname(os.path.dirname(script_dir)), 'ind', 'lib')
+if ind_lib_path not in sys.path: sys.path.append(ind_lib_path)
+from groupstats import group_moments, SUM
+
 # --- 2. CONFIGURATION ---
-BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw')
-DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed')
-REPORT_XLSX = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx')
-REPORT_IMG = os.path.join(BASE_PATH, 'reports', 'varcog', 'graficos')
+BASE_PATH = Path(__file__).resolve().parents[2]
+DATA_RAW = BASE_PATH / 'data' / 'raw'
+DATA_PROCESSED = BASE_PATH / 'data' / 'processed'
+REPORT_XLSX = BASE_PATH / 'reports' / 'varcog' / 'xlsx'
+REPORT_IMG = BASE_PATH / 'reports' / 'varcog' / 'graficos'
 
-os.makedirs(DATA_PROCESSED, exist_ok=True)
-os.makedirs(REPORT_XLSX, exist_ok=True)
-os.makedirs(REPORT_IMG, exist_ok=True)
+for p in [DATA_PROCESSED, REPORT_XLSX, REPORT_IMG]:
+    p.mkdir(parents=True, exist_ok=True)
 
 # MAPPINGS
 IBGE_TO_SIGLA = {
@@ -66,16 +74,41 @@ REGIONAL_MAP = {
     'S': ['PR','SC','RS'],
     'CO': ['MS','MT','GO','DF']
 }
-UF_TO_REGION = {uf: r for r, ufs in REGIONAL_MAP.items() for uf in ufs}
 
-def load_and_process():
+# Lookup tables for vectorized mapping. UF_INDEX and REGION_BY_CODE are dense
+# (indexed directly by the IBGE code, 0..53); -1 marks codes that are not a UF.
+IBGE_CODES = np.array(sorted(IBGE_TO_SIGLA), dtype=np.int8)
+SIGLA_LUT = np.array([IBGE_TO_SIGLA[c] for c in IBGE_CODES], dtype=object)
+REGION_NAMES = np.array(list(REGIONAL_MAP), dtype=object)
+
+UF_INDEX = np.full(54, -1, dtype=np.int8)
+UF_INDEX[IBGE_CODES] = np.arange(len(IBGE_CODES))
+REGION_BY_CODE = np.full(54, -1, dtype=np.int8)
+for code, sigla in IBGE_TO_SIGLA.items():
+    REGION_BY_CODE[code] = next(i for i, r in enumerate(REGIONAL_MAP) if sigla in REGIONAL_MAP[r])
+
+def _render(grouped, img_path):
+    """Draws the ranking chart (runs in a child process; matplotlib is imported lazily)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(10, 6))
+    sns.barplot(data=grouped, x='SAEB_General', y='UF', hue='Region', dodge=False)
+    plt.title('SAEB 2023 Ranking (Standardized)')
+    plt.tight_layout()
+    plt.savefig(img_path)
+    plt.close()
+
+def load_and_process(plot=False):
     print("="*60)
     print("[START] SAEB 2023 Processing")
     print("="*60)
 
-    zip_file = os.path.join(DATA_RAW, 'microdados_saeb_2023.zip')
+    zip_file = DATA_RAW / 'microdados_saeb_2023.zip'
     
-    if not os.path.exists(zip_file):
+    if not zip_file.exists():
         print(f"[ERROR] File not found: {zip_file}")
         return
 
@@ -98,24 +131,47 @@ def load_and_process():
                 'MEDIA_EM_MT': 'Math_Mean'
             }
             
+            # Arrow parses and types the columns during the streamed CSV scan
+            read_opts = pacsv.ReadOptions(encoding='latin1', block_size=8 << 20)
+            parse_opts = pacsv.ParseOptions(delimiter=';')
+            convert_opts = pacsv.ConvertOptions(
+                include_columns=list(cols_map),
+                column_types={'ID_UF': pa.int8(), 'MEDIA_EM_LP': pa.float32(), 'MEDIA_EM_MT': pa.float32()},
+                null_values=['', 'NA', '.']
+            )
+
+            # Aggregation (State Level): early aggregation while the CSV streams in.
+            # Each record batch is folded into fixed per-UF accumulators, so the full
+            # table is never materialized.
+            nbins = len(IBGE_CODES)
+            math_sum = np.zeros(nbins)
+            lang_sum = np.zeros(nbins)
+            counts = np.zeros(nbins, np.int64)
             with z.open(target) as f:
-                df = pd.read_csv(f, sep=';', usecols=cols_map.keys(), encoding='latin1')
-            
-            # Rename to Standard English
-            df = df.rename(columns=cols_map)
-            
-            # Clean Numeric
-            for col in ['Language_Mean', 'Math_Mean']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.dropna(subset=['Language_Mean', 'Math_Mean'])
-            
-            # Map Geography
-            df['UF'] = df['UF_ID'].map(IBGE_TO_SIGLA)
-            df['Region'] = df['UF'].map(UF_TO_REGION)
-            
-            # Aggregation (State Level)
-            grouped = df.groupby(['Region', 'UF'])[['Math_Mean', 'Language_Mean']].mean().reset_index()
+                reader = pacsv.open_csv(f, read_options=read_opts, parse_options=parse_opts, convert_options=convert_opts)
+                for batch in reader:
+                    codes = batch.column('ID_UF').fill_null(0).to_numpy()
+                    math = batch.column('MEDIA_EM_MT').to_numpy(zero_copy_only=False).astype(np.float64)
+                    lang = batch.column('MEDIA_EM_LP').to_numpy(zero_copy_only=False).astype(np.float64)
+
+                    # Map Geography (dense gather by IBGE code); unknown UFs and rows
+                    # missing either score get code -1 and are skipped by the kernel
+                    idx = UF_INDEX[np.where((codes > 0) & (codes < len(UF_INDEX)), codes, 0)]
+                    valid = (idx >= 0) & ~np.isnan(math) & ~np.isnan(lang)
+                    grp = np.where(valid, idx, -1).astype(np.intp)
+
+                    n, sums = group_moments(grp, np.column_stack([math, lang]), nbins)
+                    math_sum += sums[SUM, :, 0]
+                    lang_sum += sums[SUM, :, 1]
+                    counts += n
+
+            present = counts > 0
+            grouped = pd.DataFrame({
+                'Region': REGION_NAMES[REGION_BY_CODE[IBGE_CODES[present]]],
+                'UF': SIGLA_LUT[present],
+                'Math_Mean': math_sum[present] / counts[present],
+                'Language_Mean': lang_sum[present] / counts[present]
+            })
             
             # Global Score Calculation
             grouped['SAEB_General'] = (grouped['Math_Mean'] + grouped['Language_Mean']) / 2
@@ -136,28 +192,29 @@ def load_and_process():
                 guard.validate(strict=True)
 
             # SAVE
-            csv_path = os.path.join(DATA_PROCESSED, 'saeb_table_2023.csv')
-            xlsx_path = os.path.join(REPORT_XLSX, 'saeb_table_2023.xlsx')
-            img_path = os.path.join(REPORT_IMG, 'ranking_saeb_2023.png')
+            csv_path = DATA_PROCESSED / 'saeb_table_2023.csv'
+            xlsx_path = REPORT_XLSX / 'saeb_table_2023.xlsx'
+            img_path = REPORT_IMG / 'ranking_saeb_2023.png'
 
             grouped.to_csv(csv_path, index=False)
-            grouped.to_excel(xlsx_path, index=False)
+            grouped.to_excel(xlsx_path, index=False, engine='xlsxwriter')
             
             print(f"[SUCCESS] Data saved:")
             print(f"          CSV:  {csv_path}")
             print(f"          XLSX: {xlsx_path}")
 
-            # Generate Graph (Optional visual check)
-            plt.figure(figsize=(10, 6))
-            sns.barplot(data=grouped, x='SAEB_General', y='UF', hue='Region', dodge=False)
-            plt.title('SAEB 2023 Ranking (Standardized)')
-            plt.tight_layout()
-            plt.savefig(img_path)
-            print(f"          IMG:  {img_path}")
+            # Generate Graph (Optional visual check, rendered off the main process).
+            # 'spawn' keeps the child clear of the numba/Arrow thread pools (fork-unsafe).
+            if plot:
+                mp.get_context('spawn').Process(target=_render, args=(grouped, img_path)).start()
+                print(f"          IMG:  {img_path}")
 
     except Exception as e:
         print(f"[CRITICAL ERROR] {e}")
         # import traceback; traceback.print_exc()
 
 if __name__ == "__main__":
-    load_and_process()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="SAEB 2023 UF/Region aggregation")
+    parser.add_argument('--plot', action='store_true', help="also render the ranking chart")
+    args = parser.parse_args()
+    load_and_process(plot=args.plot)
\ No newline at end of file
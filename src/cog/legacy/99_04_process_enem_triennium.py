@@ -17,11 +17,16 @@ DESCRIPTION:
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import io
 import os
 import zipfile
 import sys
 import logging
 import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 
 # --- WINDOWS TIMEOUT INPUT ---
 try:
@@ -78,6 +83,10 @@ UF_REGION_MAP = {
     'MS': 'Center-West', 'MT': 'Center-West', 'GO': 'Center-West', 'DF': 'Center-West'
 }
 
+# Fixed UF index: chunk results are folded into (27 x K) accumulators by position
+UF_ORDER = np.array(sorted(UF_REGION_MAP), dtype=object)
+UF_INDEX = {uf: i for i, uf in enumerate(UF_ORDER)}
+
 class EnemPipeline:
     def __init__(self, year, file_path):
         self.year = year
@@ -114,17 +123,19 @@ class EnemPipeline:
                 if not target_filename:
                     print(f"   [ERROR] No CSV found."); return
 
-                with z.open(target_filename) as f:
+                with z.open(target_filename) as raw:
                     # 1. Detect Separator & Read Header
-                    first_line = f.readline().decode('latin-1')
+                    # Sniffed from peek(): the stream stays at offset 0, so the CSV reader below
+                    # decompresses the member once (seek(0) on a zip member restarts decompression)
+                    f = io.BufferedReader(raw, buffer_size=1 << 20)
+                    head = f.peek(1 << 16)
+                    first_line = head.decode('latin-1').splitlines()[0]
                     sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
                     
-                    header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
+                    header = pd.read_csv(io.BytesIO(head), sep=sep, encoding='latin-1', nrows=0).columns.tolist()
                     if len(header) < 2:
                         sep = ',' if sep == ';' else ';'
-                        f.seek(0)
-                        header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
+                        header = pd.read_csv(io.BytesIO(head), sep=sep, encoding='latin-1', nrows=0).columns.tolist()
                     
                     print(f"   [DEBUG] Headers found (Top 5): {header[:5]}")
 
@@ -147,11 +158,38 @@ class EnemPipeline:
 
                     # 3. Process Data
                     cols_to_load = list(col_map.keys())
-                    chunk_size = 250000 
-                    agg_storage = [] 
+
+                    # Running per-UF accumulators (sum / count / sum of squares per score column)
+                    score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
+                    present_scores = [c for c in score_cols if c in col_map.values()]
+                    target_cols = present_scores + ['Mean_General']
+                    nbins, k_cols = len(UF_ORDER), len(target_cols)
+                    acc_sum = np.zeros((nbins, k_cols))
+                    acc_sq = np.zeros((nbins, k_cols))
+                    acc_cnt = np.zeros((nbins, k_cols))
+                    acc_pub = np.zeros(nbins)
+                    acc_net = np.zeros(nbins)
+                    acc_rows = np.zeros(nbins, np.int64)
                     
-                    f.seek(0)
-                    reader = pd.read_csv(f, sep=sep, encoding='latin-1', usecols=cols_to_load, chunksize=chunk_size)
+                    # Arrow streaming CSV reader: record batches straight off the zip stream, in bounded
+                    # memory. open_csv parses on a single thread (only read_csv parallelises, and it
+                    # materialises the whole table); the inflate is single-threaded anyway. 64 MB
+                    # blocks keep the per-batch Python work negligible next to it.
+                    # Every loaded column is typed up front, so nothing is inferred per block: scores
+                    # as float32, the small status/school codes as int8 and UF dictionary-encoded.
+                    reader = pacsv.open_csv(
+                        f,
+                        read_options=pacsv.ReadOptions(encoding='latin1', block_size=64 << 20),
+                        parse_options=pacsv.ParseOptions(delimiter=sep),
+                        convert_options=pacsv.ConvertOptions(
+                            include_columns=cols_to_load,
+                            column_types={raw: (pa.float32() if k in score_cols
+                                                else pa.dictionary(pa.int32(), pa.string()) if k == 'UF'
+                                                else pa.int8())
+                                          for raw, k in col_map.items()},
+                            strings_can_be_null=True
+                        )
+                    )
                     
                     batch_idx = 0
                     total_rows = 0
@@ -161,12 +199,12 @@ class EnemPipeline:
                     if not has_status_col:
                         print("   [WARN] 'TP_ST_CONCLUSAO' not found. 3EM Filter DISABLED (Processing ALL).")
 
-                    for chunk in reader:
+                    for batch in reader:
                         batch_idx += 1
-                        total_rows += len(chunk)
+                        total_rows += batch.num_rows
                         
                         # Rename to Standard Internal Names
-                        chunk = chunk.rename(columns=col_map)
+                        chunk = batch.to_pandas().rename(columns=col_map)
                         
                         # --- FILTER: ONLY 3EM (If column exists) ---
                         if has_status_col:
@@ -178,17 +216,13 @@ class EnemPipeline:
                         if batch_idx % 10 == 0:
                             print(f"   ... Processed {total_rows/1e6:.1f}M rows (Active: {filtered_rows/1e6:.1f}M)", end='\r')
 
-                        # 4. Clean Scores (0 -> NaN)
-                        score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
-                        present_scores = [c for c in score_cols if c in chunk.columns]
-                        
-                        if present_scores:
-                            chunk[present_scores] = chunk[present_scores].replace(0, np.nan)
-                            chunk['Mean_General'] = chunk[present_scores].mean(axis=1)
-                        else:
-                            chunk['Mean_General'] = np.nan
-
-                        target_cols = present_scores + ['Mean_General']
+                        # 4. Clean Scores (0 -> NaN) on the raw array, then the row mean of the valid ones
+                        scores = chunk[present_scores].to_numpy(np.float64)
+                        scores[scores == 0] = np.nan
+                        scored = ~np.isnan(scores)
+                        with np.errstate(divide='ignore', invalid='ignore'):
+                            mean_general = np.where(scored, scores, 0.0).sum(axis=1) / scored.sum(axis=1)
+                        all_vals = np.column_stack([scores, mean_general])
 
                         # 5. Public/Private Map (Hybrid Logic)
                         # Option A: Standard SCHOOL_TYPE (TP_ESCOLA) -> 2=Pub, 3=Priv
@@ -208,49 +242,55 @@ class EnemPipeline:
                         else:
                             chunk['Is_Public'] = np.nan
 
-                        # 6. Aggregation
-                        sq_cols = chunk[target_cols].pow(2)
-                        sq_cols.columns = [f"{c}_sq" for c in target_cols]
-                        chunk_sq = pd.concat([chunk[['UF']], sq_cols], axis=1)
-                        
-                        g_scores = chunk.groupby('UF')[target_cols].agg(['sum', 'count'])
-                        g_sq = chunk_sq.groupby('UF')[[c for c in chunk_sq.columns if '_sq' in c]].sum()
-                        g_net = chunk.groupby('UF')['Is_Public'].agg(['sum', 'count'])
-                        g_net.columns = ['Public_Sum', 'Network_Valid_Count']
-
-                        chunk_res = pd.concat([g_scores, g_sq, g_net], axis=1)
-                        agg_storage.append(chunk_res)
+                        # 6. Aggregation (folded in place; no per-chunk frames to concat)
+                        # Batch categories -> fixed UF index; the extra slot (-1) catches null UFs
+                        uf = chunk['UF'].cat
+                        lut = np.array([UF_INDEX.get(u, -1) for u in uf.categories] + [-1], dtype=np.intp)
+                        codes = lut[uf.codes.to_numpy()]
+                        keep = codes >= 0
+                        codes = codes[keep]
+                        vals = all_vals[keep]
+                        valid = ~np.isnan(vals)
+                        vals = np.where(valid, vals, 0.0)
+                        for j in range(k_cols):
+                            acc_sum[:, j] += np.bincount(codes, weights=vals[:, j], minlength=nbins)
+                            acc_sq[:, j] += np.bincount(codes, weights=vals[:, j] ** 2, minlength=nbins)
+                            acc_cnt[:, j] += np.bincount(codes, weights=valid[:, j], minlength=nbins)
+
+                        pub = chunk['Is_Public'].to_numpy(np.float64)[keep]
+                        pub_valid = ~np.isnan(pub)
+                        acc_pub += np.bincount(codes, weights=np.where(pub_valid, pub, 0.0), minlength=nbins)
+                        acc_net += np.bincount(codes, weights=pub_valid, minlength=nbins)
+                        acc_rows += np.bincount(codes, minlength=nbins)
 
             # --- CONSOLIDATION ---
-            if not agg_storage:
+            present = acc_rows > 0
+            if not present.any():
                 print("\n   [WARN] No data found.")
                 return
 
             print(f"\n   [INFO] Consolidating metrics...")
-            full_agg = pd.concat(agg_storage).groupby(level=0).sum()
-            final_df = pd.DataFrame(index=full_agg.index)
+            final_df = pd.DataFrame(index=pd.Index(UF_ORDER[present], name='UF'))
             
             # Recalculate
-            present_scores = [c for c in ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay'] if (c, 'sum') in full_agg.columns]
-            target_cols = present_scores + ['Mean_General']
-            
-            for col in target_cols:
-                sum_val = full_agg[(col, 'sum')]
-                count_val = full_agg[(col, 'count')]
-                sum_sq_val = full_agg[f"{col}_sq"]
-                
-                final_df[col] = sum_val / count_val
-                variance = (sum_sq_val / count_val) - (final_df[col] ** 2)
-                final_df[f"{col}_std"] = np.sqrt(variance.clip(lower=0)) 
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for j, col in enumerate(target_cols):
+                    sum_val = acc_sum[present, j]
+                    count_val = acc_cnt[present, j]
+                    sum_sq_val = acc_sq[present, j]
+                    
+                    final_df[col] = sum_val / count_val
+                    variance = (sum_sq_val / count_val) - (final_df[col] ** 2)
+                    final_df[f"{col}_std"] = np.sqrt(variance.clip(lower=0)) 
 
-            # Network Stats
-            final_df['Public_Share'] = full_agg['Public_Sum'] / full_agg['Network_Valid_Count']
-            
-            if 'Essay' in present_scores:
-                total_students = full_agg[('Essay', 'count')]
-                final_df['Network_Data_Coverage'] = full_agg['Network_Valid_Count'] / total_students
-            else:
-                final_df['Network_Data_Coverage'] = np.nan
+                # Network Stats
+                final_df['Public_Share'] = acc_pub[present] / acc_net[present]
+                
+                if 'Essay' in present_scores:
+                    total_students = acc_cnt[present, present_scores.index('Essay')]
+                    final_df['Network_Data_Coverage'] = acc_net[present] / total_students
+                else:
+                    final_df['Network_Data_Coverage'] = np.nan
             
             # --- SAVING ---
             final_df = final_df.reset_index()
@@ -268,7 +308,7 @@ class EnemPipeline:
             xlsx_path = os.path.join(REPORT_XLSX, f"{fname}.xlsx")
             
             final_df.to_csv(csv_path, index=False)
-            final_df.to_excel(xlsx_path, index=False)
+            final_df.to_excel(xlsx_path, index=False, engine='xlsxwriter')
             
             print(f"   -> Saved: {fname}.xlsx")
             self.logger.info(f"SUCCESS. Saved {fname}")
@@ -279,6 +319,10 @@ class EnemPipeline:
             import traceback
             traceback.print_exc()
 
+def run_pipeline(job):
+    """Process one year (module-level so ProcessPoolExecutor can pickle it)."""
+    EnemPipeline(*job).process()
+
 def main():
     os.system('cls' if os.name == 'nt' else 'clear')
     print("=== ENEM UNIFIED PIPELINE v3.1 (Adaptive 2024) ===")
@@ -292,6 +336,7 @@ def main():
     print(f"\n[QUEUE] Processing: {years}")
     print("-" * 50)
 
+    jobs = []
     for y in years:
         default_path = os.path.join(DATA_RAW, f"microdados_enem_{y}.zip")
         final_path = None
@@ -304,8 +349,15 @@ def main():
                 final_path = user_path
         
         if final_path:
-            pipeline = EnemPipeline(y, final_path)
-            pipeline.process()
+            jobs.append((y, final_path))
+
+    # Years read disjoint zips and write disjoint outputs: one process per year
+    # ('spawn' so workers do not inherit the parent's Arrow thread pool)
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1), mp_context=mp.get_context('spawn')) as ex:
+            list(ex.map(run_pipeline, jobs))
+    else:
+        for job in jobs: run_pipeline(job)
 
     print("\n[DONE] Pipeline finished.")
 
@@ -42,7 +42,7 @@ def analyze_correlations():
     print("="*60)
 
     out_excel = XLSX_DIR / 'pisa_correlations_waves.xlsx'
-    writer = pd.ExcelWriter(out_excel, engine='openpyxl')
+    writer = pd.ExcelWriter(out_excel, engine='xlsxwriter')
     
     for year, info in FILES.items():
         filename = info['file']
@@ -71,6 +71,15 @@ import os
 import seaborn as sns
 import matplotlib.pyplot as plt
 from pathlib import Path
+from functools import lru_cache
+
+# Leitor XLSX rápido opcional (calamine, em Rust); sem ele usa o engine padrão do pandas
+try:
+    import python_calamine
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+EXCEL_ENGINE = 'calamine' if HAS_CALAMINE else None
 
 # --- CONFIGURAÇÃO ---
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
@@ -107,21 +116,35 @@ UF_TO_REGION = {
     'RO':'North', 'RR':'North', 'SC':'South', 'SP':'Southeast', 'SE':'Northeast', 'TO':'North'
 }
 
+# Lookup denso UF -> região (int8); ordem alfabética mantém a ordem de saída do groupby por nome
+UF_ORDER = sorted(UF_TO_REGION)
+REGION_ORDER = sorted(set(UF_TO_REGION.values()))
+UF_TO_REG_CODE = np.array([REGION_ORDER.index(UF_TO_REGION[u]) for u in UF_ORDER], dtype=np.int8)
+
+@lru_cache(maxsize=None)
+def _dir_files(d):
+    # Lista cada diretório de entrada uma única vez (um scandir no lugar de um stat por candidato)
+    try:
+        return frozenset(e.name for e in os.scandir(d))
+    except FileNotFoundError:
+        return frozenset()
+
+def _exists(path_obj):
+    return path_obj.name in _dir_files(str(path_obj.parent))
+
 def load_file_smart(path_obj):
-    if path_obj.exists():
-        return pd.read_csv(path_obj) if path_obj.suffix == '.csv' else pd.read_excel(path_obj)
+    if _exists(path_obj):
+        return pd.read_csv(path_obj) if path_obj.suffix == '.csv' else pd.read_excel(path_obj, engine=EXCEL_ENGINE)
     if 'saeb' in str(path_obj).lower() and '3EM' in str(path_obj):
         alt_path = Path(str(path_obj).replace('3EM', '9EF'))
-        if alt_path.exists():
+        if _exists(alt_path):
             print(f"   [INFO] Usando Proxy: {alt_path.name}")
-            return pd.read_csv(alt_path) if alt_path.suffix == '.csv' else pd.read_excel(alt_path)
+            return pd.read_csv(alt_path) if alt_path.suffix == '.csv' else pd.read_excel(alt_path, engine=EXCEL_ENGINE)
     return None
 
 def find_col(df, preferred, synonyms):
-    if preferred in df.columns: return preferred
-    for s in synonyms:
-        if s in df.columns: return s
-    return None
+    cset = set(df.columns)
+    return next((c for c in (preferred, *synonyms) if c in cset), None)
 
 def normalize_cols(df, key_pref, score_pref, prefix):
     key_synonyms = ['UF', 'SG_UF', 'SG_UF_PROVA', 'Estado', 'Region', 'REGION']
@@ -164,12 +187,16 @@ def aggregate_to_region(df_state):
     
     sample = str(df['KEY'].iloc[0])
     if len(sample) == 2 and sample in UF_TO_REGION:
-        df['Region'] = df['KEY'].map(UF_TO_REGION)
+        codes = pd.Categorical(df['KEY'], categories=UF_ORDER).codes
+        valid = codes >= 0
+        region_codes = UF_TO_REG_CODE[codes[valid]]
         
         # Filtra apenas colunas que são Score ou Grade NUMÉRICA
         target_cols = [c for c in df.columns if ('Score' in c or 'Grade' in c) and pd.api.types.is_numeric_dtype(df[c])]
         
-        return df.groupby('Region')[target_cols].mean().reset_index().rename(columns={'Region': 'KEY'})
+        out = df.loc[valid, target_cols].groupby(region_codes).mean()
+        out.insert(0, 'KEY', [REGION_ORDER[i] for i in out.index])
+        return out.reset_index(drop=True)
     
     return df
 
@@ -178,7 +205,7 @@ def run_triangulation():
     print("      TRIANGULAÇÃO V1.4 (Safe Numeric Aggregation)")
     print("="*60)
     
-    writer = pd.ExcelWriter(REPORTS_XLSX / 'triangulation_waves_consolidated.xlsx', engine='openpyxl')
+    writer = pd.ExcelWriter(REPORTS_XLSX / 'triangulation_waves_consolidated.xlsx', engine='xlsxwriter')
     
     for wave, srcs in FILES_MAP.items():
         print(f"\n--- Processando Onda {wave} ---")
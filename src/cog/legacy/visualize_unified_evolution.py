@@ -119,11 +119,12 @@ def run_plot():
     plt.ylabel("Desempenho PISA (Média Regional)", fontsize=13)
     
     # Rótulos nos Pontos
-    for i, row in master.iterrows():
+    xs = master['ENEM_Score'].to_numpy(); ys = master['PISA_Score'].to_numpy(); labels = master['Region_Label'].to_numpy()
+    for x, y, label in zip(xs, ys, labels):
         plt.text(
-            row['ENEM_Score'] + 0.8, 
-            row['PISA_Score'] + 0.8, 
-            row['Region_Label'], 
+            x + 0.8, 
+            y + 0.8, 
+            label, 
             fontsize=10, 
             weight='bold',
             color='#333333'
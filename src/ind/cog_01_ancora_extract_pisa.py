@@ -29,19 +29,35 @@ RASTREABILITY SETTINGS:
     - LOG_FILE:    logs/pisa_pipeline_[year].log
 
 DEPENDENCIES:
-    pandas, numpy, pyreadstat, openpyxl, re
+    pandas, numpy, pyreadstat, pyarrow, xlsxwriter, re
+    numba (opcional: kernel de agregação; sem ele, fallback em np.bincount)
 ================================================================================
 """
 
 import pandas as pd
 import numpy as np
 import os
+import re
 import sys
-import time
+import codecs
+import hashlib
+import pickle
+import multiprocessing as mp
 import pyreadstat
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import warnings
 
+# Utilitários compartilhados (src/ind/lib): kernel de agregação (numba opcional lá dentro) e input_timeout
+script_dir = os.path.dirname(os.path.abspath(__file__))
+lib_path = os.path.join(script_dir, 'lib')
+if lib_path not in sys.path: sys.path.append(lib_path)
+from console import input_timeout
+from groupstats import group_moments
+
 warnings.filterwarnings("ignore")
 
 # --- GLOBAL CONFIG ---
@@ -52,46 +68,56 @@ REPORT_DIR = PROJECT_ROOT / 'reports' / 'varcog'
 CSV_OUT_DIR = PROJECT_ROOT / 'data' / 'processed' / 'testes'
 XLSX_OUT_DIR = REPORT_DIR / 'xlsx'
 LOG_DIR = PROJECT_ROOT / 'logs'
+CACHE_DIR = PROJECT_ROOT / 'data' / 'cache' / 'pisa'
 
-for path in [CSV_OUT_DIR, XLSX_OUT_DIR, LOG_DIR]:
+for path in [CSV_OUT_DIR, XLSX_OUT_DIR, LOG_DIR, CACHE_DIR]:
     path.mkdir(parents=True, exist_ok=True)
 
-# --- WINDOWS TIMEOUT INPUT UTILITY (UPDATED v8.2) ---
-try:
-    import msvcrt
-    def input_timeout(prompt, timeout=10, default=''):
-        print(f"{prompt} [Automático em {timeout}s]: ", end='', flush=True)
-        start_time = time.time()
-        input_chars = []
-        while True:
-            if msvcrt.kbhit():
-                # Fix: Use getwch to avoid double echo on screen
-                char = msvcrt.getwch()
-                if char == '\r': # Enter key
-                    print()
-                    res = "".join(input_chars).strip()
-                    return res if res else default
-                input_chars.append(char)
-                print(char, end='', flush=True) # Manual echo
-            
-            # ALTERAÇÃO v8.2: O timeout só ocorre se o usuário NÃO digitou nada ainda
-            if not input_chars and (time.time() - start_time) > timeout:
-                print(f"\n[TIMEOUT] Usando padrão: {default}")
-                return default
-            time.sleep(0.05)
-except ImportError:
-    def input_timeout(prompt, timeout=10, default=''):
-        res = input(f"{prompt} [Enter para Padrão {default}]: ").strip()
-        return res if res else default
+# Padrão do país (compilado uma vez; avaliado só nos valores distintos de CNT)
+BRA_RE = re.compile(r'BRA|Brazil|76', re.IGNORECASE)
+
+# Estratos regionais: 2018 codifica a região em 'BRAxx'; 2022 traz o nome (CENTRO tem prioridade)
+REGION_CODE_2018 = {'01': 'North', '02': 'Northeast', '03': 'Southeast', '04': 'South', '05': 'Center-West'}
+REGION_RE_2022 = re.compile(r'(CENTRO|NORDESTE|SUDESTE|NORTE|SUL)')
+REGION_NAME_2022 = {'CENTRO': 'Center-West', 'NORDESTE': 'Northeast', 'SUDESTE': 'Southeast', 'NORTE': 'North', 'SUL': 'South'}
+
+# Regiões em ordem fixa: posição = índice do acumulador, estável entre blocos de leitura
+REGIONS = ['North', 'Northeast', 'Southeast', 'South', 'Center-West']
+REGION_POS = {r: i for i, r in enumerate(REGIONS)}
+SAV_CHUNK_ROWS = 200_000
+
+def region_2018(text):
+    """Região a partir do rótulo do estrato 2018 ('BRA' + código de região)."""
+    return text.str.slice(3, 5).map(REGION_CODE_2018).where(text.str.startswith('BRA'))
+
+def region_2022(text):
+    """Região a partir do nome presente no rótulo do estrato 2022."""
+    return text.str.extract(REGION_RE_2022, expand=False).map(REGION_NAME_2022)
+
+def stratum_codes(col, labels, resolve):
+    """Posição do grupo por linha (-1 = descartar), resolvida uma vez por categoria do estrato."""
+    cat = col.astype('category')
+    cats = pd.Series(cat.cat.categories)
+    text = cats.map(labels).fillna(cats.astype(str)) if labels else cats.astype(str)
+    pos = resolve(text.str.upper().str.strip()).fillna(-1).to_numpy(np.int64)
+    return np.append(pos, -1)[cat.cat.codes.to_numpy()]
+
+def category_mask(col, test):
+    """Máscara por linha com `test` avaliado só nas categorias distintas (nulos = False)."""
+    cat = col.astype('category')
+    hit = np.asarray(test(cat.cat.categories.astype(str)), dtype=bool)
+    return np.append(hit, False)[cat.cat.codes.to_numpy()]
 
 class PisaUnifiedETL:
-    def __init__(self, mode='BOTH', user_concepts=None):
+    def __init__(self, mode='BOTH', user_concepts=None, write_xlsx=True):
         """
         :param mode: 'SIMPLE', 'WEIGHTED', 'BOTH'
         :param user_concepts: List of concept keys (e.g. ['Math', 'Global']) or None for ALL.
+        :param write_xlsx: Also write the .xlsx report next to the CSV (False for batch runs).
         """
         self.mode = mode.upper()
         self.user_concepts = user_concepts
+        self.write_xlsx = write_xlsx
         
         # Base Translations
         self.translate_map = {
@@ -100,8 +126,12 @@ class PisaUnifiedETL:
             'Read': 'Leitura', 'Read_Mean': 'Leitura',
             'Science': 'Ciências', 'Science_Mean': 'Ciências',
             'Cognitive_Global_Mean': 'Média_Geral',
-            'Student_Count': 'N_Alunos'
+            'Student_Count': 'N_Alunos',
+            'PV1MATH': 'Matemática', 'PV1READ': 'Leitura', 'PV1SCIE': 'Ciências'
         }
+        # Tabela completa de renomeação (simples + '_Ponderada'), montada uma vez
+        self._full_map = {**self.translate_map,
+                          **{f'{base}_Ponderada': f'{pt}_Ponderada' for base, pt in self.translate_map.items()}}
         
         self.region_trans = {
             'North': 'Norte', 'Northeast': 'Nordeste', 
@@ -119,32 +149,95 @@ class PisaUnifiedETL:
             'Count': 'N_Alunos'
         }
 
-    def _calc_weighted(self, df, group_col, val_cols):
-        """Calculates weighted mean using W_FSTUWT (Robust to NaNs)."""
+    def _sav_meta(self, path):
+        """Column names and value labels of a .sav, read once (metadata only) and cached next to the Parquet cache."""
+        key = hashlib.blake2b(f'{path}|{os.path.getmtime(path)}'.encode()).hexdigest()[:16]
+        meta_path = CACHE_DIR / f'{Path(path).stem}_{key}.meta.pkl'
+        if meta_path.exists():
+            with open(meta_path, 'rb') as fh:
+                return pickle.load(fh)
+        _, meta = pyreadstat.read_sav(str(path), metadataonly=True)
+        info = (list(meta.column_names), dict(meta.variable_value_labels))
+        # Escrita atômica: outro processo nunca lê um arquivo pela metade
+        tmp_path = meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump(info, fh)
+        os.replace(tmp_path, meta_path)
+        return info
+
+    def _sav_chunks(self, path, cols):
+        """Yields `cols` of a .sav in chunks; the trimmed columns are cached as Parquet (zstd) for later runs."""
+        # Chave: arquivo + mtime + colunas (mudou o .sav ou a seleção, gera outro cache)
+        key = hashlib.blake2b(f'{path}|{os.path.getmtime(path)}|{",".join(sorted(cols))}'.encode()).hexdigest()[:16]
+        cache_path = CACHE_DIR / f'{Path(path).stem}_{key}.parquet'
+        if cache_path.exists():
+            for batch in pq.ParquetFile(cache_path).iter_batches(batch_size=SAV_CHUNK_ROWS, columns=list(cols)):
+                yield batch.to_pandas()
+            return
+
+        tmp_path = cache_path.with_suffix('.tmp')
+        writer = None
         try:
-            results = []
-            df['W_FSTUWT'] = pd.to_numeric(df['W_FSTUWT'], errors='coerce')
-            
-            for col in val_cols:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                
-                def weighted_avg(x):
-                    valid = x[col].notna() & x['W_FSTUWT'].notna()
-                    d = x.loc[valid, col]
-                    w = x.loc[valid, 'W_FSTUWT']
-                    if w.sum() > 0:
-                        return np.average(d, weights=w)
-                    return np.nan
-
-                wm = df.groupby(group_col).apply(weighted_avg).reset_index(name=f'{col}_Ponderada')
-                results.append(wm)
-            
-            final_w = results[0]
-            for r in results[1:]: final_w = pd.merge(final_w, r, on=group_col)
-            return final_w
-        except Exception as e:
-            # print(f"   [DEBUG] Weighted calc issue: {e}") 
-            return None
+            for chunk, _ in pyreadstat.read_file_in_chunks(
+                    pyreadstat.read_sav, str(path), chunksize=SAV_CHUNK_ROWS, usecols=list(cols),
+                    disable_datetime_conversion=True, multiprocess=True, num_processes=max(2, (os.cpu_count() or 2) // 2)):
+                # Notas (0-1000) e pesos cabem em float32: já na leitura, antes do cache e das reduções
+                num_cols = [c for c in chunk.columns if c.startswith('PV') or c == 'W_FSTUWT']
+                # to_numeric só onde a coluna não veio numérica; o cast para float32 é um único astype
+                text_cols = [c for c in num_cols if not pd.api.types.is_numeric_dtype(chunk[c])]
+                if text_cols: chunk[text_cols] = chunk[text_cols].apply(pd.to_numeric, errors='coerce')
+                chunk = chunk.astype(dict.fromkeys(num_cols, np.float32))
+                if tmp_path is not None:
+                    try:
+                        table = pa.Table.from_pandas(chunk, preserve_index=False)
+                        if writer is None:
+                            writer = pq.ParquetWriter(tmp_path, table.schema, compression='zstd')
+                        writer.write_table(table.cast(writer.schema))
+                    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                        # Tipos incompatíveis entre blocos: segue sem cache
+                        if writer is not None: writer.close(); writer = None
+                        tmp_path.unlink(missing_ok=True); tmp_path = None
+                yield chunk
+            if writer is not None:
+                writer.close(); writer = None
+                os.replace(tmp_path, cache_path)
+        finally:
+            # Leitura interrompida: não deixa cache parcial para trás
+            if writer is not None:
+                writer.close()
+                tmp_path.unlink(missing_ok=True)
+
+    def _stream_group_stats(self, path, cols, val_cols, nbins, code_fn):
+        """Streams `cols` from a .sav in chunks, accumulating per-group stats; code_fn(chunk) gives group positions (-1 = skip)."""
+        n = np.zeros(nbins, np.int64)
+        acc = np.zeros((5, nbins, len(val_cols)))
+        for chunk in self._sav_chunks(path, cols):
+            codes = code_fn(chunk)
+            # Notas e peso saem numa única extração (colunas já em float32 desde a leitura)
+            block = chunk[val_cols + ['W_FSTUWT']].to_numpy(np.float32)
+            vals, w = np.ascontiguousarray(block[:, :-1]), np.ascontiguousarray(block[:, -1])
+            # Acumuladores aditivos: somar os parciais de cada bloco equivale a uma passada única
+            cn, cacc = group_moments(codes, vals, nbins, weights=w)
+            n += cn
+            acc += cacc
+        return n, acc
+
+    def _group_frame(self, group_col, keys, n, acc, val_cols):
+        """Student_Count, simple/W_FSTUWT-weighted means and their Cognitive_Global_Mean for the groups that had rows, built in one frame."""
+        seen = n > 0
+        acc = acc[:, seen]
+        cols = {group_col: np.asarray(keys)[seen], 'Student_Count': n[seen]}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Médias simples e ponderadas saem dos mesmos acumuladores: uma única construção do DataFrame
+            if self.mode in ['SIMPLE', 'BOTH']:
+                means = acc[0] / acc[1]
+                cols.update(zip(val_cols, means.T))
+                cols['Cognitive_Global_Mean'] = means.sum(axis=1) / len(val_cols)
+            if self.mode in ['WEIGHTED', 'BOTH']:
+                wmeans = np.where(acc[3] > 0, acc[2] / acc[3], np.nan)
+                cols.update(zip([f'{c}_Ponderada' for c in val_cols], wmeans.T))
+                cols['Cognitive_Global_Mean_Ponderada'] = wmeans.sum(axis=1) / len(val_cols)
+        return pd.DataFrame(cols)
 
     def _apply_standardization(self, df, year):
         """Applies translation and filters based on Concept x Method logic."""
@@ -153,79 +246,48 @@ class PisaUnifiedETL:
         if 'Region' in df.columns:
             df['Region'] = df['Region'].replace(self.region_trans)
         
-        # 2. Rename Simple Cols
-        df = df.rename(columns=self.translate_map)
-        
-        # 3. Rename Weighted Cols (Dynamic)
-        new_cols = {}
-        for col in df.columns:
-            if '_Ponderada' in col:
-                base = col.replace('_Ponderada', '')
-                if base in self.translate_map:
-                    new_cols[col] = f"{self.translate_map[base]}_Ponderada"
-                elif f"{base}_Mean" in self.translate_map:
-                     new_cols[col] = f"{self.translate_map[f'{base}_Mean']}_Ponderada"
-        if new_cols: df = df.rename(columns=new_cols)
+        # 2-3. Rename Simple + Weighted Cols (precomputed table)
+        df = df.rename(columns=self._full_map)
 
         df['Ano'] = int(year)
         
         # 4. Filter Logic (The Core Change)
-        keep_cols = []
-        all_cols = df.columns.tolist()
-        base_mandatory = ['Ano', 'Região', 'UF', 'IBGE_CODE', 'N_Alunos', 'Student_Count']
-        
-        for col in all_cols:
-            is_weighted = 'Ponderada' in col
-            
-            # A) Check Mandatory
-            if col in base_mandatory:
-                # Special check for N_Alunos if user didn't ask for it
-                if col in ['N_Alunos', 'Student_Count'] and self.user_concepts and 'Count' not in self.user_concepts:
-                     pass 
-                keep_cols.append(col)
-                continue
-            
-            # B) Check Concept (Subject)
-            # If user_concepts is None, we keep all concepts.
-            # If user_concepts has list, we check if column matches any selected concept.
-            concept_match = True
-            if self.user_concepts:
-                concept_match = False
-                for concept_key in self.user_concepts:
-                    pt_term = self.concept_matcher.get(concept_key, '###')
-                    if pt_term in col:
-                        concept_match = True
-                        break
-            
-            if not concept_match: continue # Skip this column
-
-            # C) Check Method (Simple vs Weighted)
-            method_match = False
-            if self.mode == 'BOTH':
-                method_match = True
-            elif self.mode == 'WEIGHTED':
-                if is_weighted: method_match = True
-            elif self.mode == 'SIMPLE':
-                if not is_weighted: method_match = True
-            
-            if method_match:
-                keep_cols.append(col)
-        
-        # Deduplicate
-        df = df[list(set(keep_cols))]
+        # One boolean mask per rule over df.columns; the selection keeps the column order (no set())
+        cols = df.columns
+        n_cols = len(cols)
+        is_weighted = np.asarray(cols.str.contains('Ponderada', regex=False), dtype=bool)
+
+        # A) Mandatory (N_Alunos/Student_Count included even if 'Count' was not requested)
+        mandatory = np.asarray(cols.isin(['Ano', 'Região', 'UF', 'IBGE_CODE', 'N_Alunos', 'Student_Count']))
+
+        # B) Concept (Subject): None keeps all concepts; otherwise any selected PT-BR term must match
+        if self.user_concepts:
+            # One regex union over the selected PT-BR terms: a single scan of the column names
+            pt_terms = [self.concept_matcher[k] for k in self.user_concepts if k in self.concept_matcher]
+            if pt_terms:
+                concept = np.asarray(cols.str.contains('|'.join(map(re.escape, pt_terms)), regex=True), dtype=bool)
+            else:
+                concept = np.zeros(n_cols, dtype=bool)
+        else:
+            concept = np.ones(n_cols, dtype=bool)
+
+        # C) Method (Simple vs Weighted)
+        method = {'BOTH': np.ones(n_cols, dtype=bool), 'WEIGHTED': is_weighted, 'SIMPLE': ~is_weighted}.get(self.mode, np.zeros(n_cols, dtype=bool))
+
+        df = df.loc[:, mandatory | (concept & method)]
 
         # 5. Order
         priority = ['Ano', 'Região', 'UF', 'Média_Geral', 'Média_Geral_Ponderada', 'N_Alunos']
         remaining = sorted([c for c in df.columns if c not in priority])
         ordered = [c for c in priority if c in df.columns] + remaining
         
-        final_df = df[ordered]
+        # Reindex only when the layout actually changes (avoids rebuilding the frame's blocks)
+        final_df = df if list(df.columns) == ordered else df[ordered]
         
-        # Sort Rows
-        if 'Média_Geral' in final_df.columns:
-            final_df = final_df.sort_values('Média_Geral', ascending=False)
-        elif 'Média_Geral_Ponderada' in final_df.columns:
-            final_df = final_df.sort_values('Média_Geral_Ponderada', ascending=False)
+        # Sort Rows (descending by a single key: argsort over the negated column keeps NaN last)
+        key_col = next((c for c in ['Média_Geral', 'Média_Geral_Ponderada'] if c in final_df.columns), None)
+        if key_col:
+            final_df = final_df.iloc[np.argsort(-final_df[key_col].to_numpy(np.float64), kind='stable')]
             
         return final_df
     
@@ -237,68 +299,60 @@ class PisaUnifiedETL:
         
         full_name = f"{fname}{suffix}"
         
-        # Encoding utf-8-sig para garantir acentos corretos no Excel BR
-        df.to_csv(CSV_OUT_DIR / f"{full_name}.csv", index=False, encoding='utf-8-sig')
-        df.to_excel(XLSX_OUT_DIR / f"{full_name}.xlsx", index=False)
+        # Encoding utf-8-sig para garantir acentos corretos no Excel BR (BOM + escritor CSV do Arrow, em C++)
+        csv_path = CSV_OUT_DIR / f"{full_name}.csv"
+        try:
+            with open(csv_path, 'wb') as fh:
+                fh.write(codecs.BOM_UTF8)
+                pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), fh)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+            df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+        # XLSX é só relatório (o CSV tem os mesmos dados): opcional via --no-xlsx
+        if self.write_xlsx:
+            df.to_excel(XLSX_OUT_DIR / f"{full_name}.xlsx", index=False, engine='xlsxwriter')
         
-        print(f"   [OK] Gerado: {full_name}.csv e .xlsx | N: {int(df['N_Alunos'].sum())}")
+        print(f"   [OK] Gerado: {full_name}.csv{' e .xlsx' if self.write_xlsx else ''} | N: {int(df['N_Alunos'].sum())}")
 
     def run_2015(self):
         print(f"\n[INÍCIO] Processando PISA 2015 (Estados)...")
         base_path = DATA_RAW_ROOT / 'pisa_2015'
         if not base_path.exists(): print(f"[PULAR] Pasta não encontrada: {base_path}"); return
 
-        sav_files = [f for f in os.listdir(base_path) if 'STU' in f and f.endswith('.sav')]
+        # scandir: um só passe pelo diretório, tipo do arquivo já vem no DirEntry; ordenado para ser determinístico
+        with os.scandir(base_path) as it:
+            sav_files = sorted(e.name for e in it if e.is_file() and 'STU' in e.name and e.name.endswith('.sav'))
         if not sav_files: print("[ERRO] Arquivo .sav ausente."); return
         target_file = base_path / sav_files[0]
 
         # Static Mapping (2015 specific)
         NAME_TO_IBGE = {'RONDONIA': 11, 'RONDÔNIA': 11, 'ACRE': 12, 'AMAZONAS': 13, 'RORAIMA': 14, 'PARA': 15, 'PARÁ': 15, 'AMAPA': 16, 'AMAPÁ': 16, 'TOCANTINS': 17, 'MARANHAO': 21, 'MARANHÃO': 21, 'PIAUI': 22, 'PIAUÍ': 22, 'CEARA': 23, 'CEARÁ': 23, 'RIO GRANDE DO NORTE': 24, 'PARAIBA': 25, 'PARAÍBA': 25, 'PERNAMBUCO': 26, 'ALAGOAS': 27, 'SERGIPE': 28, 'BAHIA': 29, 'MINAS GERAIS': 31, 'ESPIRITO SANTO': 32, 'ESPÍRITO SANTO': 32, 'RIO DE JANEIRO': 33, 'SAO PAULO': 35, 'SÃO PAULO': 35, 'PARANA': 41, 'PARANÁ': 41, 'SANTA CATARINA': 42, 'RIO GRANDE DO SUL': 43, 'MATO GROSSO DO SUL': 50, 'MATO GROSSO': 51, 'GOIAS': 52, 'GOIÁS': 52, 'DISTRITO FEDERAL': 53}
         REGION_CODE_TO_NAME = {11:'North', 12:'North', 13:'North', 14:'North', 15:'North', 16:'North', 17:'North', 21:'Northeast', 22:'Northeast', 23:'Northeast', 24:'Northeast', 25:'Northeast', 26:'Northeast', 27:'Northeast', 28:'Northeast', 29:'Northeast', 31:'Southeast', 32:'Southeast', 33:'Southeast', 35:'Southeast', 41:'South', 42:'South', 43:'South', 50:'Center-West', 51:'Center-West', 52:'Center-West', 53:'Center-West'}
+        STATE_NAME_RE = '(' + '|'.join(re.escape(k) for k in sorted(NAME_TO_IBGE, key=len, reverse=True)) + ')'
         IBGE_TO_SIGLA = {11:'RO', 12:'AC', 13:'AM', 14:'RR', 15:'PA', 16:'AP', 17:'TO', 21:'MA', 22:'PI', 23:'CE', 24:'RN', 25:'PB', 26:'PE', 27:'AL', 28:'SE', 29:'BA', 31:'MG', 32:'ES', 33:'RJ', 35:'SP', 41:'PR', 42:'SC', 43:'RS', 50:'MS', 51:'MT', 52:'GO', 53:'DF'}
 
         try:
-            _, meta = pyreadstat.read_sav(str(target_file), metadataonly=True)
-            region_col = next((c for c in ['STRATUM', 'REGION', 'CNT', 'ST004D01T'] if c in meta.column_names), None)
-            scores = [c for c in meta.column_names if c.startswith('PV1') and any(x in c for x in ['MATH', 'READ', 'SCIE'])]
+            # Cabeçalho lido uma vez (ou do cache): com o Parquet em cache o .sav nem é aberto
+            column_names, value_labels = self._sav_meta(target_file)
+            region_col = next((c for c in ['STRATUM', 'REGION', 'CNT', 'ST004D01T'] if c in column_names), None)
+            scores = [c for c in column_names if c.startswith('PV1') and any(x in c for x in ['MATH', 'READ', 'SCIE'])]
             use_cols = list(set([region_col] + scores + ['W_FSTUWT']))
-            if 'CNT' in meta.column_names: use_cols.append('CNT')
-
-            df, meta = pyreadstat.read_sav(str(target_file), usecols=use_cols)
-            if 'CNT' in df.columns: df = df[df['CNT'] == 'BRA'].copy()
-
-            if region_col in meta.variable_value_labels:
-                labels = meta.variable_value_labels[region_col]
-                df['STRATUM_TEXT'] = df[region_col].map(labels).fillna(df[region_col].astype(str))
-            else: df['STRATUM_TEXT'] = df[region_col].astype(str)
-
-            def resolve_ibge(txt):
-                if not isinstance(txt, str): return None
-                txt = txt.upper()
-                for k in sorted(NAME_TO_IBGE.keys(), key=len, reverse=True):
-                    if k in txt: return NAME_TO_IBGE[k]
-                return None
-            
-            df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(resolve_ibge)
-            df = df.dropna(subset=['IBGE_CODE'])
+            if 'CNT' in column_names: use_cols.append('CNT')
+
+            # Estados em ordem fixa de código IBGE: a posição indexa os acumuladores de todos os blocos
+            ibge_codes = sorted(IBGE_TO_SIGLA)
+            ibge_pos = {c: i for i, c in enumerate(ibge_codes)}
+            labels = value_labels.get(region_col)
+
+            def to_codes(chunk):
+                # Uma única alternância (nomes mais longos primeiro: 'MATO GROSSO DO SUL' antes de 'MATO GROSSO')
+                codes = stratum_codes(chunk[region_col], labels,
+                                      lambda t: t.str.extract(STATE_NAME_RE, expand=False).map(NAME_TO_IBGE).map(ibge_pos))
+                if 'CNT' in chunk.columns: codes[~category_mask(chunk['CNT'], lambda c: c == 'BRA')] = -1
+                return codes
+
+            n, acc = self._stream_group_stats(target_file, use_cols, ['PV1MATH', 'PV1READ', 'PV1SCIE'], len(ibge_codes), to_codes)
+            summary = self._group_frame('IBGE_CODE', ibge_codes, n, acc, ['Math', 'Read', 'Science'])
             
-            rename_pv = {'PV1MATH': 'Math', 'PV1READ': 'Read', 'PV1SCIE': 'Science'}
-            df = df.rename(columns={k:v for k,v in rename_pv.items() if k in df.columns})
-
-            summary = df['IBGE_CODE'].value_counts().reset_index()
-            summary.columns = ['IBGE_CODE', 'Student_Count']
-            
-            if self.mode in ['SIMPLE', 'BOTH']:
-                means = df.groupby('IBGE_CODE')[['Math', 'Read', 'Science']].mean().reset_index()
-                summary = pd.merge(summary, means, on='IBGE_CODE')
-                summary['Cognitive_Global_Mean'] = summary[['Math', 'Read', 'Science']].mean(axis=1)
-
-            if self.mode in ['WEIGHTED', 'BOTH']:
-                means_w = self._calc_weighted(df, 'IBGE_CODE', ['Math', 'Read', 'Science'])
-                if means_w is not None:
-                    summary = pd.merge(summary, means_w, on='IBGE_CODE')
-                    summary['Cognitive_Global_Mean_Ponderada'] = summary[['Math_Ponderada', 'Read_Ponderada', 'Science_Ponderada']].mean(axis=1)
-
             summary['UF'] = summary['IBGE_CODE'].map(IBGE_TO_SIGLA)
             summary['Region'] = summary['IBGE_CODE'].map(REGION_CODE_TO_NAME)
             
@@ -308,68 +362,44 @@ class PisaUnifiedETL:
         except Exception as e: print(f"   [ERRO] {e}")
 
     def run_2018(self):
-        print(f"\n[INÍCIO] Processando PISA 2018 (Regiões)...")
-        RAW_FILE = DATA_RAW_ROOT / 'pisa_2018' / 'CY07_MSU_STU_QQQ.sav'
-        if not RAW_FILE.exists(): print(f"[PULAR] Arquivo faltante."); return
-        self._generic_regional_run(RAW_FILE, 2018)
+        self._run_regional(DATA_RAW_ROOT / 'pisa_2018' / 'CY07_MSU_STU_QQQ.sav', 2018, 'regional', region_2018)
 
     def run_2022(self):
-        print(f"\n[INÍCIO] Processando PISA 2022 (Regiões)...")
-        RAW_FILE = DATA_RAW_ROOT / 'pisa_2022' / 'CY08MSP_STU_QQQ.sav'
-        if not RAW_FILE.exists(): print(f"[PULAR] Arquivo faltante."); return
-        self._generic_regional_run(RAW_FILE, 2022)
+        self._run_regional(DATA_RAW_ROOT / 'pisa_2022' / 'CY08MSP_STU_QQQ.sav', 2022, 'regional', region_2022)
 
-    def _generic_regional_run(self, file_path, year):
+    def _run_regional(self, raw_file, year, scope, region_fn):
+        """Shared regional pipeline; region_fn maps the upper-cased stratum labels to region names."""
+        print(f"\n[INÍCIO] Processando PISA {year} (Regiões)...")
+        if not raw_file.exists(): print(f"[PULAR] Arquivo faltante."); return
         cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE', 'W_FSTUWT']
         try:
-            df = pd.read_spss(str(file_path), usecols=cols)
-            df = df[df['CNT'].astype(str).str.contains('BRA|Brazil|76', case=False, na=False)].copy()
-            if df.empty: print("[ERRO] Dados Brasil vazios."); return
-
-            def get_region(s, y):
-                s = str(s).upper().strip()
-                if y == 2018:
-                    if s.startswith('BRA'):
-                        code = s[3:5]
-                        if code == '01': return 'North'
-                        if code == '02': return 'Northeast'
-                        if code == '03': return 'Southeast'
-                        if code == '04': return 'South'
-                        if code == '05': return 'Center-West'
-                else: # 2022
-                    if 'CENTRO' in s: return 'Center-West'
-                    if 'NORDESTE' in s: return 'Northeast'
-                    if 'SUDESTE' in s: return 'Southeast'
-                    if 'NORTE' in s: return 'North'
-                    if 'SUL' in s: return 'South'
-                return 'UNKNOWN'
-
-            df['Region'] = df['STRATUM'].apply(lambda x: get_region(x, year))
-            df = df[df['Region'] != 'UNKNOWN']
-            
-            summary = df['Region'].value_counts().reset_index()
-            summary.columns = ['Region', 'Student_Count']
-            
-            if self.mode in ['SIMPLE', 'BOTH']:
-                means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
-                summary = pd.merge(summary, means, on='Region')
-                summary['Cognitive_Global_Mean'] = (summary['PV1MATH'] + summary['PV1READ'] + summary['PV1SCIE']) / 3
-            
-            if self.mode in ['WEIGHTED', 'BOTH']:
-                means_w = self._calc_weighted(df, 'Region', ['PV1MATH', 'PV1READ', 'PV1SCIE'])
-                if means_w is not None:
-                    summary = pd.merge(summary, means_w, on='Region')
-                    summary['Cognitive_Global_Mean_Ponderada'] = (summary['PV1MATH_Ponderada'] + summary['PV1READ_Ponderada'] + summary['PV1SCIE_Ponderada']) / 3
-
-            ren = {'PV1MATH': 'Math_Mean', 'PV1READ': 'Read_Mean', 'PV1SCIE': 'Science_Mean',
-                   'PV1MATH_Ponderada': 'Matemática_Ponderada', 'PV1READ_Ponderada': 'Leitura_Ponderada', 'PV1SCIE_Ponderada': 'Ciências_Ponderada'}
-            summary = summary.rename(columns=ren)
+            # Só os metadados aqui (em cache): os rótulos do STRATUM são aplicados às categorias de cada bloco
+            labels = self._sav_meta(raw_file)[1].get('STRATUM')
+
+            def to_codes(chunk):
+                # Poucas dezenas de estratos: rótulo e região resolvidos nas categorias, linhas só indexam pelo código
+                codes = stratum_codes(chunk['STRATUM'], labels, lambda t: region_fn(t).map(REGION_POS))
+                # CNT como categórico: o padrão do país roda só nas ~80 categorias, as linhas comparam códigos inteiros
+                codes[~category_mask(chunk['CNT'], lambda c: c.str.contains(BRA_RE))] = -1
+                return codes
+
+            n, acc = self._stream_group_stats(raw_file, cols, ['PV1MATH', 'PV1READ', 'PV1SCIE'], len(REGIONS), to_codes)
+            if not n.any(): print("[ERRO] Dados Brasil vazios."); return
+            summary = self._group_frame('Region', REGIONS, n, acc, ['PV1MATH', 'PV1READ', 'PV1SCIE'])
             
             final_df = self._apply_standardization(summary, year)
-            self._save(final_df, f'pisa_table_{year}_regional')
+            self._save(final_df, f'pisa_table_{year}_{scope}')
 
         except Exception as e: print(f"   [ERRO] {e}")
 
+def run_year(job):
+    """Processa um ano (função de módulo para ser serializável pelo ProcessPoolExecutor)."""
+    mode, user_concepts, write_xlsx, year = job
+    etl = PisaUnifiedETL(mode=mode, user_concepts=user_concepts, write_xlsx=write_xlsx)
+    if year == 2015: etl.run_2015()
+    elif year == 2018: etl.run_2018()
+    elif year == 2022: etl.run_2022()
+
 def main():
     os.system('cls' if os.name == 'nt' else 'clear')
     print("=== PISA UNIFIED PIPELINE v8.3 ===")
@@ -433,19 +463,25 @@ def main():
     # --------------------
     mode_map = {'1': 'SIMPLE', '2': 'WEIGHTED', '3': 'BOTH'}
     selected_mode = mode_map.get(op, 'BOTH')
+    # Execuções em lote podem pular o relatório XLSX: python cog_01_ancora_extract_pisa.py --no-xlsx
+    write_xlsx = '--no-xlsx' not in sys.argv
 
     print("-" * 60)
-    print(f"[CONFIG] Anos: {years} | Modo: {selected_mode} | Indicadores: {'TODOS' if not user_concepts else len(user_concepts)}")
+    print(f"[CONFIG] Anos: {years} | Modo: {selected_mode} | Indicadores: {'TODOS' if not user_concepts else len(user_concepts)} | XLSX: {'Sim' if write_xlsx else 'Não'}")
     print("-" * 60)
 
-    etl = PisaUnifiedETL(mode=selected_mode, user_concepts=user_concepts)
-
+    jobs = []
     for year in years:
-        if year == 2015: etl.run_2015()
-        elif year == 2018: etl.run_2018()
-        elif year == 2022: etl.run_2022()
+        if year in (2015, 2018, 2022): jobs.append((selected_mode, user_concepts, write_xlsx, year))
         else: print(f"[AVISO] Ano {year} não suportado.")
 
+    # Anos são independentes (arquivo .sav e saída próprios): um processo por ano
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1), mp_context=mp.get_context('spawn')) as ex:
+            list(ex.map(run_year, jobs))
+    else:
+        for job in jobs: run_year(job)
+
     print("\n[CONCLUÍDO] PISA Finalizado.")
 
 if __name__ == "__main__":
@@ -26,29 +26,46 @@ RASTREABILITY SETTINGS:
     - LOG_FILE:    logs/saeb_pipeline_[year].log
 
 DEPENDENCIES:
-    pandas, numpy, zipfile, logging, os
+    pandas, numpy, pyarrow, numba (opcional), xlsxwriter, zipfile, io, logging, os
 ================================================================================
 """
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import os
+import hashlib
+import io
 import zipfile
 import logging
-import time
 import warnings
+import sys
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Utilitários compartilhados (src/ind/lib): kernel de agregação (numba opcional lá dentro) e input_timeout
+script_dir = os.path.dirname(os.path.abspath(__file__))
+lib_path = os.path.join(script_dir, 'lib')
+if lib_path not in sys.path: sys.path.append(lib_path)
+from console import input_timeout
+from groupstats import group_moments, SUM, WSUM, WEIGHT
 
 warnings.filterwarnings("ignore")
 
 # --- GLOBAL CONFIG ---
-BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw', 'saeb')
-DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed', 'testes')
-REPORT_XLSX = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx') 
-LOG_DIR = os.path.join(BASE_PATH, 'logs')
+BASE_PATH = Path(__file__).resolve().parents[2]
+DATA_RAW = BASE_PATH / 'data' / 'raw' / 'saeb'
+DATA_PROCESSED = BASE_PATH / 'data' / 'processed' / 'testes'
+REPORT_XLSX = BASE_PATH / 'reports' / 'varcog' / 'xlsx'
+LOG_DIR = BASE_PATH / 'logs'
+CACHE_DIR = BASE_PATH / 'data' / 'cache' / 'saeb'
 
-for p in [DATA_RAW, DATA_PROCESSED, LOG_DIR, REPORT_XLSX]: 
-    os.makedirs(p, exist_ok=True)
+for p in [DATA_RAW, DATA_PROCESSED, LOG_DIR, REPORT_XLSX, CACHE_DIR]: 
+    p.mkdir(parents=True, exist_ok=True)
 
 IBGE_TO_SIGLA = {
     11:'RO', 12:'AC', 13:'AM', 14:'RR', 15:'PA', 16:'AP', 17:'TO',
@@ -66,37 +83,42 @@ UF_REGION_MAP = {
     'MS': 'Centro-Oeste', 'MT': 'Centro-Oeste', 'GO': 'Centro-Oeste', 'DF': 'Centro-Oeste'
 }
 
-# --- WINDOWS TIMEOUT INPUT UTILITY ---
-try:
-    import msvcrt
-    def input_timeout(prompt, timeout=10, default=''):
-        print(f"{prompt} [Automático em {timeout}s]: ", end='', flush=True)
-        start_time = time.time()
-        input_chars = []
-        while True:
-            if msvcrt.kbhit():
-                char = msvcrt.getwche()
-                if char == '\r': 
-                    print()
-                    res = "".join(input_chars).strip()
-                    return res if res else default
-                input_chars.append(char)
-                print(char, end='', flush=True)
-            if (time.time() - start_time) > timeout:
-                print(f"\n[TIMEOUT] Usando padrão: {default}")
-                return default
-            time.sleep(0.05)
-except ImportError:
-    def input_timeout(prompt, timeout=10, default=''):
-        res = input(f"{prompt} [Enter para Padrão {default}]: ").strip()
-        return res if res else default
+# UF como categórico de dicionário fixo (27 siglas em ordem alfabética): 1 byte por escola
+UF_CAT = pd.CategoricalDtype(sorted(UF_REGION_MAP))
+
+# Tabelas de consulta (código IBGE -> posição da sigla em UF_CAT) para mapeamento vetorizado
+IBGE_CODES = np.array(sorted(IBGE_TO_SIGLA), dtype=np.int8)
+UF_POS_LUT = np.array([UF_CAT.categories.get_loc(IBGE_TO_SIGLA[c]) for c in IBGE_CODES], dtype=np.int8)
+
+def map_ibge_codes(codes, lut, missing=None):
+    """Mapeia códigos IBGE para valores de `lut` via busca binária (códigos desconhecidos -> missing)."""
+    codes = np.asarray(codes, dtype=np.float64)
+    idx = np.clip(np.searchsorted(IBGE_CODES, codes), 0, len(IBGE_CODES) - 1)
+    return np.where(IBGE_CODES[idx] == codes, lut[idx], missing)
+
+def ensure_float(s):
+    """Converte uma coluna para float32 despachando pelo dtype (texto só passa pelo replace se for object)."""
+    if s.dtype.kind == 'f': return s
+    if s.dtype.kind in 'iub': return s.astype(np.float32)
+    return pd.to_numeric(s.astype(str).str.replace(',', '.', regex=False), errors='coerce').astype(np.float32)
+
+def arrow_scores_float(col):
+    """Nota lida como texto -> float32 no Arrow, aceitando vírgula ou ponto decimal em qualquer linha.
+    Célula vazia vira nulo; token não numérico (ex.: '*') vira NaN, como no ensure_float."""
+    col = pc.replace_substring(col, ',', '.')
+    col = pc.if_else(pc.equal(col, ''), pa.scalar(None, pa.string()), col)
+    try:
+        return pc.cast(col, pa.float32())
+    except pa.ArrowInvalid:
+        return pa.chunked_array([pd.to_numeric(col.to_pandas(), errors='coerce').to_numpy(np.float32)])
 
 class SaebPipeline:
-    def __init__(self, year, file_path, filter_network, user_cols=None):
+    def __init__(self, year, file_path, filter_network, user_cols=None, write_xlsx=True):
         self.year = year
         self.file_path = file_path
         self.filter_network = filter_network
         self.user_cols = user_cols
+        self.write_xlsx = write_xlsx
 
     def get_quantity_column(self, header, grade):
         header_upper = {h.upper(): h for h in header}
@@ -111,16 +133,44 @@ class SaebPipeline:
         return None
 
     def find_grade_columns(self, header, grade):
-        lp = next((h for h in header if ('MEDIA' in h.upper() or 'PROFICIENCIA' in h.upper()) and grade in h.upper() and ('LP' in h.upper() or 'LINGUA' in h.upper())), None)
-        mt = next((h for h in header if ('MEDIA' in h.upper() or 'PROFICIENCIA' in h.upper()) and grade in h.upper() and ('MT' in h.upper() or 'MAT' in h.upper())), None)
+        # Busca vetorizada de substrings sobre o header inteiro (máscaras booleanas)
+        cols = np.asarray(header, dtype=str)
+        u = np.char.upper(cols)
+        has = lambda s: np.char.find(u, s) >= 0
+        first = lambda mask: str(cols[mask][0]) if mask.any() else None
+
+        media = has('MEDIA')
+        base = (media | has('PROFICIENCIA')) & has(grade)
+        lp = first(base & (has('LP') | has('LINGUA')))
+        mt = first(base & (has('MT') | has('MAT')))
         qty = self.get_quantity_column(header, grade)
         
         if not (lp and mt) and grade == '3EM':
-            lp = next((h for h in header if 'MEDIA' in h.upper() and '_EM_' in h.upper() and 'LP' in h.upper()), None)
-            mt = next((h for h in header if 'MEDIA' in h.upper() and '_EM_' in h.upper() and 'MT' in h.upper()), None)
+            em = media & has('_EM_')
+            lp = first(em & has('LP'))
+            mt = first(em & has('MT'))
             if not qty: qty = self.get_quantity_column(header, "EM")
         return lp, mt, qty
 
+    def _cached_table(self, read_table, spec):
+        """Tabela Arrow das colunas lidas do CSV, em cache Parquet (zstd): reexecuções não descomprimem
+        nem parseiam o CSV. spec descreve a leitura (arquivo, colunas, notas) e entra na chave."""
+        # Chave: ZIP + mtime + leitura pedida (mudou o arquivo ou a seleção, gera outro cache)
+        key = hashlib.blake2b(f'{self.file_path}|{os.path.getmtime(self.file_path)}|{spec}'.encode()).hexdigest()[:16]
+        cache_path = CACHE_DIR / f'saeb_{self.year}_{key}.parquet'
+        if cache_path.exists():
+            return pq.read_table(cache_path)
+
+        table = read_table()
+        tmp_path = cache_path.with_suffix('.tmp')
+        try:
+            pq.write_table(table, tmp_path, compression='zstd')
+            os.replace(tmp_path, cache_path)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OSError):
+            # Sem cache não é erro: a tabela já está em memória
+            tmp_path.unlink(missing_ok=True)
+        return table
+
     def process(self):
         print(f"\n[INÍCIO] Processando SAEB {self.year}...")
         try:
@@ -130,59 +180,107 @@ class SaebPipeline:
                     print(f"   [ERRO] TS_ESCOLA não encontrado no ZIP.")
                     return
 
-                with z.open(target) as f:
-                    first_line = f.readline().decode('latin1')
+                with z.open(target) as raw:
+                    # Um único fluxo descomprimido: o cabeçalho é lido via peek() (sem seek(0),
+                    # que obrigaria o zipfile a descomprimir o arquivo desde o início)
+                    f = io.BufferedReader(raw, buffer_size=1 << 20)
+                    first_line = f.peek(1 << 16).decode('latin1').splitlines()[0]
                     sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
-                    header = pd.read_csv(f, sep=sep, encoding='latin1', nrows=0).columns.tolist()
+                    header = [h.strip().strip('"') for h in first_line.split(sep)]
                     
                     col_adm = next((h for h in header if any(x in h.upper() for x in ['ID_DEPENDENCIA_ADM', 'IN_PUBLICA', 'ID_REDE', 'TP_DEPENDENCIA'])), None)
                     col_uf = next((h for h in header if any(x in h.upper() for x in ['ID_UF', 'CO_UF', 'UF', 'SG_UF'])), None)
+                    # Codificação da rede decidida uma vez (IN_PUBLICA binário x código de dependência)
+                    is_in_publica = bool(col_adm) and 'IN_PUBLICA' in col_adm.upper()
 
-                    processed_grades = 0
+                    grade_cols = {}
                     for grade in ['9EF', '3EM']:
                         c_lp, c_mt, c_qty = self.find_grade_columns(header, grade)
-                        if not (c_lp and c_mt): continue 
+                        if c_lp and c_mt: grade_cols[grade] = (c_lp, c_mt, c_qty)
+
+                    if not grade_cols:
+                        print("   [AVISO] Nenhuma série processada (verifique filtros ou arquivo).")
+                        return
+
+                    # Leitura única com as colunas de todas as séries
+                    cols = list(dict.fromkeys(c for c in [col_uf, col_adm] + [c for g in grade_cols.values() for c in g] if c))
+                    score_cols = [c for lp, mt, _ in grade_cols.values() for c in (lp, mt)]
 
-                        f.seek(0)
-                        cols = [c for c in [col_uf, col_adm, c_lp, c_mt, c_qty] if c]
-                        df = pd.read_csv(f, sep=sep, encoding='latin1', usecols=cols)
+                    def read_table():
+                        # Leitor CSV do Arrow (multithread): lê apenas as colunas necessárias. As notas
+                        # entram como texto e são convertidas coluna a coluna: o separador decimal do
+                        # INEP (',' ou '.') pode variar ao longo do arquivo e não é adivinhado pelo início
+                        table = pacsv.read_csv(
+                            f,
+                            read_options=pacsv.ReadOptions(encoding='latin1', block_size=8 << 20),
+                            parse_options=pacsv.ParseOptions(delimiter=sep),
+                            convert_options=pacsv.ConvertOptions(
+                                include_columns=cols,
+                                column_types={c: pa.string() for c in score_cols}
+                            )
+                        )
+                        for c in dict.fromkeys(score_cols):
+                            table = table.set_column(table.schema.get_field_index(c), c, arrow_scores_float(table[c]))
+                        return table
 
-                        # 1. Filtro de Rede
-                        if col_adm:
-                            df['TEMP_ADM'] = pd.to_numeric(df[col_adm], errors='coerce')
-                            df['Is_Public'] = df['TEMP_ADM'].apply(lambda x: 0 if x == 4 else 1)
+                    table = self._cached_table(read_table, f'{target}|{cols}|{score_cols}')
+                    df = table.to_pandas()
+
+                    # Reduz a largura dos códigos (UF, rede) e contagens inferidos como int64/float64
+                    for c in df.columns.difference(score_cols):
+                        if pd.api.types.is_integer_dtype(df[c]): df[c] = pd.to_numeric(df[c], downcast='integer')
+                        elif pd.api.types.is_float_dtype(df[c]): df[c] = df[c].astype(np.float32)
+
+                    # 1. Filtro de Rede
+                    if col_adm:
+                        # Códigos já inteiros (int8 após o downcast) são comparados direto, sem cópia em float
+                        adm = df[col_adm]
+                        v = adm.to_numpy() if adm.dtype.kind in 'iub' else ensure_float(adm).to_numpy()
+                        if is_in_publica:
+                            # IN_PUBLICA: 1 = Pública, 0 = Privada
+                            df['Is_Public'] = (v == 1).astype(np.int8)
                         else:
-                            df['Is_Public'] = 1
-                        
-                        if self.filter_network == 'PUBLIC': df = df[df['Is_Public'] == 1]
-                        elif self.filter_network == 'PRIVATE': df = df[df['Is_Public'] == 0]
+                            # Dependência Administrativa: 4 = Privada (1, 2, 3 = Federal, Estadual, Municipal)
+                            df['Is_Public'] = (v != 4).astype(np.int8)
+                    else:
+                        df['Is_Public'] = 1
+                    
+                    if self.filter_network == 'PUBLIC': df = df[df['Is_Public'] == 1]
+                    elif self.filter_network == 'PRIVATE': df = df[df['Is_Public'] == 0]
 
-                        # 2. Normalização
-                        df['UF'] = df[col_uf].map(IBGE_TO_SIGLA) if pd.api.types.is_numeric_dtype(df[col_uf]) else df[col_uf]
-                        
-                        for c in [c_lp, c_mt]:
-                            df[c] = pd.to_numeric(df[c].astype(str).str.replace(',', '.'), errors='coerce')
-                        
-                        df['N_Alunos'] = pd.to_numeric(df[c_qty], errors='coerce').fillna(0) if c_qty else 0
+                    # 2. Normalização
+                    # Códigos inteiros de UF (uma vez para todas as séries); UF ausente -> -1
+                    if df[col_uf].dtype.kind in 'iuf':
+                        # Código IBGE numérico: direto para o código da categoria, sem criar strings nem hash por linha
+                        df['UF'] = pd.Categorical.from_codes(map_ibge_codes(df[col_uf].to_numpy(), UF_POS_LUT, missing=-1).astype(np.int8), dtype=UF_CAT)
+                        uf_codes, uf_labels = df['UF'].cat.codes.to_numpy(np.intp), UF_CAT.categories
+                    else:
+                        df['UF'] = df[col_uf]
+                        uf_codes, uf_labels = pd.factorize(df['UF'], sort=True)
+                        uf_codes = uf_codes.astype(np.intp)
+
+                    processed_grades = 0
+                    for grade, (c_lp, c_mt, c_qty) in grade_cols.items():
+                        w = ensure_float(df[c_qty]).fillna(0).to_numpy() if c_qty else np.zeros(len(df), np.float32)
                         
-                        # 3. Agregação
-                        sub = df.dropna(subset=[c_lp, c_mt]).copy()
-                        if sub.empty: continue
+                        # 3. Agregação (kernel fundido: linha sem UF ou sem LP/MT é pulada + somas por UF)
+                        n, sums = group_moments(uf_codes, df[[c_lp, c_mt]].to_numpy(np.float32), len(uf_labels), weights=w, complete=True)
+                        present = n > 0
+                        if not present.any(): continue
+                        sums = sums[:, present]
 
                         # Média Ponderada pelo N da Escola (Importante para SAEB)
-                        # Nota: Se N_Alunos for 0 (dados faltantes), usa média simples
-                        if sub['N_Alunos'].sum() > 0:
-                            agg = sub.groupby('UF').apply(
-                                lambda x: pd.Series({
-                                    'Média_Port': np.average(x[c_lp], weights=x['N_Alunos']) if x['N_Alunos'].sum() > 0 else x[c_lp].mean(),
-                                    'Média_Mat': np.average(x[c_mt], weights=x['N_Alunos']) if x['N_Alunos'].sum() > 0 else x[c_mt].mean(),
-                                    'N_Alunos': x['N_Alunos'].sum()
-                                })
-                            ).reset_index()
-                        else:
-                            agg = sub.groupby('UF').agg({c_lp: 'mean', c_mt: 'mean', 'N_Alunos': 'sum'}).reset_index()
-                            agg.rename(columns={c_lp: 'Média_Port', c_mt: 'Média_Mat'}, inplace=True)
+                        # Nota: Se N_Alunos da UF for 0 (dados faltantes), usa média simples
+                        wsum = sums[WEIGHT, :, 0]
+                        with np.errstate(divide='ignore', invalid='ignore'):
+                            port = np.where(wsum > 0, sums[WSUM, :, 0] / wsum, sums[SUM, :, 0] / n[present])
+                            mat = np.where(wsum > 0, sums[WSUM, :, 1] / wsum, sums[SUM, :, 1] / n[present])
+                        agg = pd.DataFrame({
+                            'UF': np.asarray(uf_labels)[present],
+                            'Média_Port': port,
+                            'Média_Mat': mat,
+                            'N_Alunos': wsum
+                        })
 
                         agg['Média_Geral'] = (agg['Média_Port'] + agg['Média_Mat']) / 2
                         agg['Região'] = agg['UF'].map(UF_REGION_MAP)
@@ -206,8 +304,10 @@ class SaebPipeline:
                         
                         # 5. Output
                         base_name = f"saeb_table_{self.year}_{grade}"
-                        final_df.to_csv(os.path.join(DATA_PROCESSED, f"{base_name}.csv"), index=False)
-                        final_df.to_excel(os.path.join(REPORT_XLSX, f"{base_name}.xlsx"), index=False)
+                        final_df.to_csv(DATA_PROCESSED / f"{base_name}.csv", index=False)
+                        # XLSX é só relatório (o CSV tem os mesmos dados): opcional via --no-xlsx
+                        if self.write_xlsx:
+                            final_df.to_excel(REPORT_XLSX / f"{base_name}.xlsx", index=False, engine='xlsxwriter')
                         print(f"   -> Gerado: {base_name} | Alunos: {int(agg['N_Alunos'].sum())}")
                         processed_grades += 1
                     
@@ -217,6 +317,10 @@ class SaebPipeline:
         except Exception as e:
             print(f"   [ERRO] {e}")
 
+def run_pipeline(job):
+    """Processa um ano (função de módulo para ser serializável pelo ProcessPoolExecutor)."""
+    SaebPipeline(*job).process()
+
 def main():
     os.system('cls' if os.name == 'nt' else 'clear')
     print("=== SAEB UNIFIED PIPELINE v14.7 ===")
@@ -242,27 +346,39 @@ def main():
     
     raw_cols = input_timeout(">> Digite as colunas desejadas", timeout=10, default="TODAS")
     
+    # Execuções em lote podem pular o relatório XLSX: python cog_02_capilaridade_extract_saeb.py --no-xlsx
+    write_xlsx = '--no-xlsx' not in sys.argv
+    xlsx_tag = 'Sim' if write_xlsx else 'Não'
+
     if raw_cols == "TODAS":
         user_cols_list = None
-        print(f"\n[CONFIG] Anos: {years} | Rede: {selected_filter} | Colunas: TODAS")
+        print(f"\n[CONFIG] Anos: {years} | Rede: {selected_filter} | Colunas: TODAS | XLSX: {xlsx_tag}")
     else:
         user_cols_list = [c.strip() for c in raw_cols.split(',')]
-        print(f"\n[CONFIG] Anos: {years} | Rede: {selected_filter} | Colunas: {len(user_cols_list)} selecionadas")
+        print(f"\n[CONFIG] Anos: {years} | Rede: {selected_filter} | Colunas: {len(user_cols_list)} selecionadas | XLSX: {xlsx_tag}")
     
     print("-" * 60)
 
+    jobs = []
     for y in years:
-        path = os.path.join(DATA_RAW, f"microdados_saeb_{y}.zip")
-        if os.path.exists(path):
-            SaebPipeline(y, path, selected_filter, user_cols_list).process()
+        path = DATA_RAW / f"microdados_saeb_{y}.zip"
+        if path.exists():
+            jobs.append((y, path, selected_filter, user_cols_list, write_xlsx))
         else:
             # Tenta nome alternativo comum
-            path_alt = os.path.join(DATA_RAW, f"TS_ESCOLA_{y}.zip")
-            if os.path.exists(path_alt):
-                SaebPipeline(y, path_alt, selected_filter, user_cols_list).process()
+            path_alt = DATA_RAW / f"TS_ESCOLA_{y}.zip"
+            if path_alt.exists():
+                jobs.append((y, path_alt, selected_filter, user_cols_list, write_xlsx))
             else:
                 print(f"[PULAR] Faltando: microdados_saeb_{y}.zip")
 
+    # Anos são independentes: um processo por ZIP ('spawn' evita herdar o pool de threads do Arrow)
+    if len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1), mp_context=mp.get_context('spawn')) as ex:
+            list(ex.map(run_pipeline, jobs))
+    else:
+        for job in jobs: run_pipeline(job)
+
     print("\n[CONCLUÍDO] Processos SAEB finalizados.")
 
 if __name__ == "__main__":
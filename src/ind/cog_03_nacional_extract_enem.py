@@ -23,19 +23,28 @@ RASTREABILITY SETTINGS:
     - OUTPUT_CSV:  data/processed/testes/enem_table_[year]_[filter].csv
 
 DEPENDENCIES:
-    pandas, numpy, zipfile, os
+    pandas, numpy, pyarrow, numba (opcional), xlsxwriter, zipfile, os
 ================================================================================
 """
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import os
+import hashlib
+import io
 import zipfile
-import time
-import warnings
 import sys
+from functools import lru_cache
 
-warnings.filterwarnings("ignore")
+# Utilitários compartilhados (src/ind/lib): kernel de agregação (numba opcional lá dentro) e input_timeout
+script_dir = os.path.dirname(os.path.abspath(__file__))
+lib_path = os.path.join(script_dir, 'lib')
+if lib_path not in sys.path: sys.path.append(lib_path)
+from console import input_timeout
+from groupstats import group_moments, SUM
 
 # --- GLOBAL CONFIG ---
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -43,8 +52,9 @@ DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw', 'enem')
 DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed', 'testes')
 REPORT_XLSX = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx')
 LOG_DIR = os.path.join(BASE_PATH, 'logs')
+CACHE_DIR = os.path.join(BASE_PATH, 'data', 'cache', 'enem')
 
-for p in [DATA_RAW, DATA_PROCESSED, REPORT_XLSX, LOG_DIR]:
+for p in [DATA_RAW, DATA_PROCESSED, REPORT_XLSX, LOG_DIR, CACHE_DIR]:
     os.makedirs(p, exist_ok=True)
 
 # Mapeamento expandido para garantir que pegue 2015
@@ -68,47 +78,71 @@ UF_REGION_MAP = {
     'MS': 'Centro-Oeste', 'MT': 'Centro-Oeste', 'GO': 'Centro-Oeste', 'DF': 'Centro-Oeste'
 }
 
-# --- UTILS (INPUT) ---
-try:
-    import msvcrt
-    def input_timeout(prompt, timeout=10, default=''):
-        sys.stdout.write(f"{prompt} [Automático em {timeout}s]: ")
-        sys.stdout.flush()
-        start_time = time.time()
-        input_chars = []
-        while True:
-            if msvcrt.kbhit():
-                char = msvcrt.getwche()
-                if char == '\r': 
-                    print()
-                    res = "".join(input_chars).strip()
-                    return res if res else default
-                input_chars.append(char)
-            if (time.time() - start_time) > timeout:
-                print(f"\n[TIMEOUT] Usando padrão: {default}")
-                return default
-            time.sleep(0.05)
-except ImportError:
-    def input_timeout(prompt, timeout=10, default=''):
-        res = input(f"{prompt} [Enter para Padrão {default}]: ").strip()
-        return res if res else default
+# Índice fixo das 27 UFs para acumuladores por posição (bincount)
+UF_ORDER = sorted(UF_REGION_MAP)
+UF_INDEX = {uf: i for i, uf in enumerate(UF_ORDER)}
+
+@lru_cache(maxsize=256)
+def find_col_flexible(header, candidates):
+    """Resolve o primeiro candidato presente no header (memoizado entre anos/modos)."""
+    header_upper = {h.upper(): h for h in header}
+    for cand in candidates:
+        if cand.upper() in header_upper: return header_upper[cand.upper()]
+    return None
 
 class EnemPipeline:
-    def __init__(self, year, file_path, filter_choice, user_cols=None):
+    def __init__(self, year, file_path, filter_choice, user_cols=None, write_xlsx=True):
         self.year = year
         self.file_path = file_path
         self.filter_choice = filter_choice
         self.user_cols = user_cols
+        self.write_xlsx = write_xlsx
 
     def get_largest_csv(self, z):
         csv_files = [f for f in z.namelist() if f.lower().endswith('.csv')]
         return sorted(csv_files, key=lambda x: z.getinfo(x).file_size, reverse=True)[0] if csv_files else None
 
     def find_col_flexible(self, header, candidates):
-        header_upper = {h.upper(): h for h in header}
-        for cand in candidates:
-            if cand.upper() in header_upper: return header_upper[cand.upper()]
-        return None
+        return find_col_flexible(tuple(header), tuple(candidates))
+
+    def _cached_batches(self, open_reader, columns, column_types):
+        """Lotes do CSV do ZIP; as colunas lidas ficam em cache Parquet (zstd) e as próximas execuções não
+        descomprimem nem parseiam o CSV. open_reader() só é chamado quando não há cache."""
+        # Chave: ZIP + mtime + colunas e tipos pedidos (mudou o arquivo ou a leitura, gera outro cache)
+        spec = f'{self.file_path}|{os.path.getmtime(self.file_path)}|{sorted(columns)}|{sorted(column_types.items(), key=str)}'
+        key = hashlib.blake2b(spec.encode()).hexdigest()[:16]
+        cache_path = os.path.join(CACHE_DIR, f'enem_{self.year}_{key}.parquet')
+        if os.path.exists(cache_path):
+            dict_cols = [c for c, t in column_types.items() if pa.types.is_dictionary(t)]
+            pf = pq.ParquetFile(cache_path, read_dictionary=dict_cols)
+            # Um row group por lote gravado: mesmos blocos (e mesma ordem de soma) da leitura do CSV
+            for i in range(pf.num_row_groups):
+                yield pf.read_row_group(i, columns=columns)
+            return
+
+        tmp_path = cache_path + '.tmp'
+        writer = None
+        try:
+            for batch in open_reader():
+                if tmp_path is not None:
+                    try:
+                        if writer is None:
+                            writer = pq.ParquetWriter(tmp_path, batch.schema, compression='zstd')
+                        writer.write_batch(batch, row_group_size=max(batch.num_rows, 1))
+                    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                        # Esquema inesperado: segue sem cache
+                        if writer is not None: writer.close(); writer = None
+                        if os.path.exists(tmp_path): os.remove(tmp_path)
+                        tmp_path = None
+                yield batch
+            if writer is not None:
+                writer.close(); writer = None
+                os.replace(tmp_path, cache_path)
+        finally:
+            # Leitura interrompida: não deixa cache parcial para trás
+            if writer is not None:
+                writer.close()
+                os.remove(tmp_path)
 
     def process(self):
         print(f"\n[INÍCIO] Processando ENEM {self.year}...")
@@ -117,17 +151,19 @@ class EnemPipeline:
                 target_filename = self.get_largest_csv(z)
                 print(f"   Arquivo alvo no ZIP: {target_filename}")
                 
-                with z.open(target_filename) as f:
-                    # Detecção de Separador e Header
-                    first_line = f.readline().decode('latin1')
+                with z.open(target_filename) as raw:
+                    # Detecção de Separador e Header via peek(): o fluxo segue na posição 0 e o
+                    # leitor consome o membro do ZIP uma única vez (seek(0) redescomprimiria desde o início)
+                    f = io.BufferedReader(raw, buffer_size=1 << 20)
+                    first_line = f.peek(1 << 16).decode('latin1').splitlines()[0]
                     sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
-                    header = pd.read_csv(f, sep=sep, encoding='latin1', nrows=0).columns.tolist()
+                    header = [h.strip().strip('"') for h in first_line.split(sep)]
                     
                     # Debug Columns
                     print(f"   Header detectado ({len(header)} colunas): {header[:5]} ...")
                     
-                    col_map = {self.find_col_flexible(header, v): k for k, v in TARGET_COLS.items() if self.find_col_flexible(header, v)}
+                    found = {k: self.find_col_flexible(header, v) for k, v in TARGET_COLS.items()}
+                    col_map = {c: k for k, c in found.items() if c}
                     print(f"   Colunas mapeadas: {list(col_map.values())}")
                     
                     # Lógica de Modos (Agora com aviso explícito de falha)
@@ -156,48 +192,77 @@ class EnemPipeline:
                         print(f"   [ABORTADO] Nenhuma coluna compatível encontrada para o filtro selecionado.")
                         return
 
-                    for mode in modes:
-                        print(f"   -> Executando Filtro: {mode}...")
-                        f.seek(0)
-                        reader = pd.read_csv(f, sep=sep, encoding='latin1', usecols=list(col_map.keys()), chunksize=500000)
-                        agg_storage = []
-                        score_cols = ['CN', 'CH', 'LC', 'MT', 'RED']
-
-                        for chunk in reader:
-                            chunk = chunk.rename(columns=col_map)
-                            
-                            # FILTROS
+                    print(f"   -> Executando Filtro(s): {', '.join(modes)}...")
+                    score_cols = ['CN', 'CH', 'LC', 'MT', 'RED']
+                    # UF chega dicionarizada (categórica): só as ~27 categorias de cada lote são consultadas;
+                    # STATUS (códigos 1-4) em int8: o filtro STRICT compara inteiros pequenos
+                    column_types = {**{raw: pa.float32() for raw, k in col_map.items() if k in score_cols},
+                                    **{raw: pa.dictionary(pa.int32(), pa.string()) for raw, k in col_map.items() if k == 'UF'},
+                                    **{raw: pa.int8() for raw, k in col_map.items() if k == 'STATUS'}}
+
+                    def open_reader():
+                        # Leitor CSV do Arrow em fluxo sobre o ZIP (single-thread, memória limitada a um
+                        # bloco): lotes colunares com as notas já tipadas como float32 pelo parser.
+                        # read_csv paraleliza o parse mas materializa a tabela inteira, e a descompressão
+                        # do membro segue single-thread de qualquer forma
+                        return pacsv.open_csv(
+                            f,
+                            read_options=pacsv.ReadOptions(encoding='latin1', block_size=64 << 20),
+                            parse_options=pacsv.ParseOptions(delimiter=sep),
+                            convert_options=pacsv.ConvertOptions(
+                                include_columns=list(col_map.keys()),
+                                column_types=column_types,
+                                strings_can_be_null=True
+                            )
+                        )
+                    reader = self._cached_batches(open_reader, list(col_map.keys()), column_types)
+                    # Acumuladores fixos por filtro (27 UFs x [notas..., Média_Geral]) atualizados por lote
+                    valid_scores = [c for c in score_cols if c in col_map.values()]
+                    sum_cols = valid_scores + ['Média_Geral']
+                    acc = {mode: (np.zeros((len(UF_ORDER), len(sum_cols))), np.zeros(len(UF_ORDER), np.int64)) for mode in modes}
+
+                    # Uma única descompressão + parse para todos os filtros (antes: nova leitura
+                    # do ZIP por modo); cada lote é decodificado uma vez e cada filtro só muda os códigos
+                    for batch in reader:
+                        chunk = batch.to_pandas().rename(columns=col_map)
+                        if chunk.empty: continue
+
+                        # Categorias do lote -> índice fixo da UF; a posição extra (-1) cobre UF nula
+                        uf = chunk['UF'].cat
+                        lut = np.array([UF_INDEX.get(u, -1) for u in uf.categories] + [-1], dtype=np.intp)
+                        codes = lut[uf.codes.to_numpy()]
+                        # Notas + Média_Geral da linha (média das notas presentes; linha sem notas fica NaN e não soma)
+                        scores = chunk[valid_scores].to_numpy(np.float64)
+                        row_n = (~np.isnan(scores)).sum(axis=1)
+                        row_mean = np.divide(np.nansum(scores, axis=1), row_n, out=np.full(len(scores), np.nan), where=row_n > 0)
+                        values = np.column_stack([scores, row_mean])
+
+                        for mode in modes:
+                            # FILTROS: linha descartada vira código -1 (o kernel pula), sem copiar as notas
                             if mode == 'STRICT':
-                                chunk = chunk[chunk['STATUS'] == 2].copy()
+                                keep = (chunk['STATUS'] == 2).to_numpy()
                             elif mode == 'PROXY':
                                 # Garante que não é nulo e não é zero
-                                chunk = chunk[chunk['SCHOOL_ID'].notna()]
-                                chunk = chunk[chunk['SCHOOL_ID'] != 0].copy()
-                            elif mode == 'NONE':
-                                pass 
-                            
-                            if chunk.empty: continue
-                            
-                            valid_scores = [c for c in score_cols if c in chunk.columns]
-                            chunk[valid_scores] = chunk[valid_scores].apply(pd.to_numeric, errors='coerce')
-                            chunk['Média_Geral'] = chunk[valid_scores].mean(axis=1)
-                            chunk['N_Alunos'] = 1 
-                            
-                            agg_chunk = chunk.groupby('UF')[valid_scores + ['Média_Geral', 'N_Alunos']].agg(['sum'])
-                            agg_storage.append(agg_chunk)
-
-                        if not agg_storage:
+                                keep = (chunk['SCHOOL_ID'].notna() & (chunk['SCHOOL_ID'] != 0)).to_numpy()
+                            else:
+                                keep = None
+                            # Somas por UF (NaN não soma) e contagem de candidatos por UF
+                            n_chunk, s_chunk = group_moments(codes if keep is None else np.where(keep, codes, -1), values, len(UF_ORDER))
+                            sums, n_alunos = acc[mode]
+                            sums += s_chunk[SUM]
+                            n_alunos += n_chunk
+
+                    for mode in modes:
+                        sums, n_alunos = acc[mode]
+                        present = n_alunos > 0
+                        if not present.any():
                             print(f"   [AVISO] Nenhum dado restou após filtragem ({mode}). Verifique se os dados contêm a informação necessária.")
                             continue
 
-                        full_agg = pd.concat(agg_storage).groupby(level=0).sum()
-                        final_df = pd.DataFrame(index=full_agg.index)
-                        total_n = full_agg[('N_Alunos', 'sum')]
-                        
-                        for col in full_agg.columns.levels[0]:
-                            final_df[col] = full_agg[(col, 'sum')] if col == 'N_Alunos' else full_agg[(col, 'sum')] / total_n
-
-                        final_df = final_df.reset_index()
+                        total_n = n_alunos[present]
+                        final_df = pd.DataFrame(sums[present] / total_n[:, None], columns=sum_cols)
+                        final_df.insert(0, 'UF', np.asarray(UF_ORDER, dtype=object)[present])
+                        final_df['N_Alunos'] = total_n
                         final_df['Região'] = final_df['UF'].map(UF_REGION_MAP)
                         final_df['Ano'] = self.year
                         
@@ -224,7 +289,9 @@ class EnemPipeline:
                         
                         fname = f"enem_table_{self.year}_{filter_tag}"
                         final_df.to_csv(os.path.join(DATA_PROCESSED, f"{fname}.csv"), index=False)
-                        final_df.to_excel(os.path.join(REPORT_XLSX, f"{fname}.xlsx"), index=False)
+                        # XLSX é só relatório (o CSV tem os mesmos dados): opcional via --no-xlsx
+                        if self.write_xlsx:
+                            final_df.to_excel(os.path.join(REPORT_XLSX, f"{fname}.xlsx"), index=False, engine='xlsxwriter')
                         
                         n_count = int(total_n.sum())
                         print(f"      [OK] Arquivo gerado: {fname} | N: {n_count}")
@@ -255,13 +322,16 @@ def main():
     print("\nCOLUNAS (Enter para TODAS):")
     raw_cols = input_timeout(">> Digite colunas", timeout=5, default="TODAS")
     user_cols_list = None if raw_cols == "TODAS" else [c.strip() for c in raw_cols.split(',')]
-    
+
+    # Execuções em lote podem pular o relatório XLSX: python cog_03_nacional_extract_enem.py --no-xlsx
+    write_xlsx = '--no-xlsx' not in sys.argv
+    print(f"\n[CONFIG] XLSX: {'Sim' if write_xlsx else 'Não'}")
     print("-" * 60)
 
     for y in years:
         path = os.path.join(DATA_RAW, f"microdados_enem_{y}.zip")
         if os.path.exists(path):
-            EnemPipeline(y, path, selected_filter, user_cols_list).process()
+            EnemPipeline(y, path, selected_filter, user_cols_list, write_xlsx).process()
         else:
             print(f"[PULAR] Arquivo não encontrado: {path}")
 
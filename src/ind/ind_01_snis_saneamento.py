@@ -179,7 +179,8 @@ def extract_snis_data(selected_plots='all'):
                 buffer_clean.write(line + '\n')
         
         buffer_clean.seek(0)
-        df = pd.read_csv(buffer_clean, sep=';', on_bad_lines='warn')
+        # decimal/thousands: the C parser reads the PT-BR numbers ("1.234,5") directly into floats
+        df = pd.read_csv(buffer_clean, sep=';', on_bad_lines='warn', decimal=',', thousands='.')
         df.columns = [str(c).strip().replace('"', '') for c in df.columns]
 
         # 2. Identify Columns
@@ -196,8 +197,9 @@ def extract_snis_data(selected_plots='all'):
         df['SG_UF_PROVA'] = df[col_uf].map(DE_PARA_UF).fillna(df[col_uf])
         df = df[df['SG_UF_PROVA'].isin(SIGLAS_UF)].copy()
 
-        # Convert numbers
+        # Convert numbers (string cleanup only for columns the parser left as text, e.g. a stray non-numeric cell)
         for col in [col_water, col_sewage]:
+            if pd.api.types.is_numeric_dtype(df[col]): continue
             df[col] = df[col].astype(str).str.replace('.', '', regex=False)
             df[col] = df[col].str.replace(',', '.', regex=False)
             df[col] = pd.to_numeric(df[col], errors='coerce')
@@ -29,11 +29,21 @@ DESCRIPTION:
 import pandas as pd
 import numpy as np
 import os
+import io
 import zipfile
 import sys
 import logging
 import time
 
+# Shared aggregation kernel (src/ind/lib; numba stays optional in there)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+lib_path = os.path.join(os.path.dirname(script_dir), 'lib')
+if lib_path not in sys.path: sys.path.append(lib_path)
+from groupstats import group_moments, SUM, COUNT, SUMSQ
+
+# Copy-on-write: filtered chunks are views until written to, so no defensive .copy() per chunk
+pd.options.mode.copy_on_write = True
+
 # --- WINDOWS TIMEOUT INPUT ---
 try:
     import msvcrt
@@ -125,17 +135,19 @@ class EnemPipeline:
                 if not target_filename:
                     print(f"   [ERROR] No CSV found."); return
 
-                with z.open(target_filename) as f:
+                with z.open(target_filename) as raw:
                     # 1. Detect Header
-                    first_line = f.readline().decode('latin-1')
+                    # Sniffed from peek(): the stream stays at offset 0, so the chunked reader below
+                    # decompresses the member once (seek(0) on a zip member restarts decompression)
+                    f = io.BufferedReader(raw, buffer_size=1 << 20)
+                    head = f.peek(1 << 16)
+                    first_line = head.decode('latin-1').splitlines()[0]
                     sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
                     
-                    header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
+                    header = pd.read_csv(io.BytesIO(head), sep=sep, encoding='latin-1', nrows=0).columns.tolist()
                     if len(header) < 2:
                         sep = ',' if sep == ';' else ';'
-                        f.seek(0)
-                        header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
+                        header = pd.read_csv(io.BytesIO(head), sep=sep, encoding='latin-1', nrows=0).columns.tolist()
                     
                     # 2. Map Columns
                     col_map = {} 
@@ -169,9 +181,20 @@ class EnemPipeline:
                     # 4. Load Data
                     cols_to_load = list(col_map.keys())
                     chunk_size = 250000 
-                    agg_storage = [] 
+
+                    score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
+                    present_scores = [c for c in score_cols if c in col_map.values()]
+                    target_cols = present_scores + ['Mean_General']
+
+                    # Running per-UF accumulators (one row per UF, SoA columns) instead of one
+                    # MultiIndex frame per chunk: memory stays constant whatever the chunk count.
+                    # Known UFs get fixed rows; any other label gets a new row when first seen.
+                    # Value columns: target_cols, then Is_Public (last).
+                    uf_pos = {uf: i for i, uf in enumerate(sorted(UF_REGION_MAP))}
+                    n_t = len(target_cols)
+                    acc = {k: np.zeros((len(uf_pos), n_t + 1)) for k in ('sum', 'count', 'sq')}
+                    acc['rows'] = np.zeros(len(uf_pos))
                     
-                    f.seek(0)
                     reader = pd.read_csv(f, sep=sep, encoding='latin-1', usecols=cols_to_load, chunksize=chunk_size)
                     
                     batch_idx = 0
@@ -186,9 +209,9 @@ class EnemPipeline:
                         
                         # --- METHODOLOGY IMPLEMENTATION ---
                         if filter_mode == 'STRICT_3EM':
-                            chunk = chunk[chunk['STATUS'] == 2].copy()
+                            chunk = chunk.loc[chunk['STATUS'].to_numpy() == 2]
                         elif filter_mode == 'PROXY_3EM':
-                            chunk = chunk[chunk['SCHOOL_ID'].notna()].copy()
+                            chunk = chunk.loc[chunk['SCHOOL_ID'].notna().to_numpy()]
                         
                         filtered_rows += len(chunk)
                         if chunk.empty: continue
@@ -197,17 +220,12 @@ class EnemPipeline:
                             print(f"   ... Processed {total_rows/1e6:.1f}M rows (Kept {filtered_rows/1e6:.1f}M)", end='\r')
 
                         # 5. Clean Scores
-                        score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
-                        present_scores = [c for c in score_cols if c in chunk.columns]
-                        
                         if present_scores:
                             chunk[present_scores] = chunk[present_scores].replace(0, np.nan)
                             chunk['Mean_General'] = chunk[present_scores].mean(axis=1)
                         else:
                             chunk['Mean_General'] = np.nan
 
-                        target_cols = present_scores + ['Mean_General']
-
                         # 6. Public/Private Map
                         if 'SCHOOL_TYPE' in chunk.columns:
                             conditions = [chunk['SCHOOL_TYPE'].isin([2]), chunk['SCHOOL_TYPE'].isin([3])]
@@ -220,50 +238,51 @@ class EnemPipeline:
                         else:
                             chunk['Is_Public'] = np.nan
 
-                        # 7. Aggregation
-                        sq_cols = chunk[target_cols].pow(2)
-                        sq_cols.columns = [f"{c}_sq" for c in target_cols]
-                        chunk_sq = pd.concat([chunk[['UF']], sq_cols], axis=1)
-                        
-                        g_scores = chunk.groupby('UF')[target_cols].agg(['sum', 'count'])
-                        g_sq = chunk_sq.groupby('UF')[[c for c in chunk_sq.columns if '_sq' in c]].sum()
-                        g_net = chunk.groupby('UF')['Is_Public'].agg(['sum', 'count'])
-                        g_net.columns = ['Public_Sum', 'Network_Valid_Count']
-
-                        chunk_res = pd.concat([g_scores, g_sq, g_net], axis=1)
-                        agg_storage.append(chunk_res)
+                        # 7. Aggregation (UF codes -> one fused pass into the running accumulators; NaN cells skipped)
+                        inv, uniques = pd.factorize(chunk['UF'])
+                        for uf in uniques:
+                            if uf not in uf_pos:
+                                uf_pos[uf] = len(uf_pos)
+                                for k, a in acc.items():
+                                    acc[k] = np.concatenate([a, np.zeros((1,) + a.shape[1:])])
+                        # Trailing -1 maps the factorize NaN code (-1) to "skip"
+                        codes = np.array([uf_pos[uf] for uf in uniques] + [-1], dtype=np.intp)[inv]
+                        values = chunk[target_cols + ['Is_Public']].to_numpy(np.float64)
+
+                        rows, moments = group_moments(codes, values, len(uf_pos))
+                        acc['sum'] += moments[SUM]
+                        acc['count'] += moments[COUNT]
+                        acc['sq'] += moments[SUMSQ]
+                        acc['rows'] += rows
 
             # --- CONSOLIDATION ---
-            if not agg_storage:
+            if not acc['rows'].any():
                 print("\n   [WARN] No data after filtering.")
                 return
 
             print(f"\n   [INFO] Consolidating metrics...")
-            full_agg = pd.concat(agg_storage).groupby(level=0).sum()
-            final_df = pd.DataFrame(index=full_agg.index)
-            
-            present_scores = [c for c in ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay'] if (c, 'sum') in full_agg.columns]
-            target_cols = present_scores + ['Mean_General']
+            # UFs that received rows, in label order (as the former groupby index)
+            labels = np.array(list(uf_pos), dtype=object)
+            order = [i for i in np.argsort(labels) if acc['rows'][i] > 0]
+            final_df = pd.DataFrame({'UF': labels[order]})
             
-            for col in target_cols:
-                sum_val = full_agg[(col, 'sum')]
-                count_val = full_agg[(col, 'count')]
-                sum_sq_val = full_agg[f"{col}_sq"]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for j, col in enumerate(target_cols):
+                    count_val = acc['count'][order, j]
+                    final_df[col] = acc['sum'][order, j] / count_val
+                    variance = (acc['sq'][order, j] / count_val) - (final_df[col] ** 2)
+                    final_df[f"{col}_std"] = np.sqrt(variance.clip(lower=0)) 
+
+                net_count = acc['count'][order, n_t]
+                final_df['Public_Share'] = acc['sum'][order, n_t] / net_count
                 
-                final_df[col] = sum_val / count_val
-                variance = (sum_sq_val / count_val) - (final_df[col] ** 2)
-                final_df[f"{col}_std"] = np.sqrt(variance.clip(lower=0)) 
-
-            final_df['Public_Share'] = full_agg['Public_Sum'] / full_agg['Network_Valid_Count']
-            
-            if 'Essay' in present_scores:
-                total_students = full_agg[('Essay', 'count')]
-                final_df['Network_Data_Coverage'] = full_agg['Network_Valid_Count'] / total_students
-            else:
-                final_df['Network_Data_Coverage'] = np.nan
+                if 'Essay' in present_scores:
+                    total_students = acc['count'][order, target_cols.index('Essay')]
+                    final_df['Network_Data_Coverage'] = net_count / total_students
+                else:
+                    final_df['Network_Data_Coverage'] = np.nan
             
             # --- SAVING ---
-            final_df = final_df.reset_index()
             final_df['Region'] = final_df['UF'].map(UF_REGION_MAP)
             final_df['Year'] = str(self.year)
             
@@ -0,0 +1,145 @@
+"""
+MODULE:      Entrada com Timeout (menus interativos)
+FILE:        src/ind/lib/console.py
+DESCRIPTION: input_timeout compartilhado pelos extratores PISA/SAEB/ENEM.
+             Espera bloqueante no stdin (sem polling): WaitForSingleObject no console do
+             Windows, select() no descritor em POSIX. Entrada que sobrou de um prompt
+             anterior (resposta atrasada após o timeout) é descartada antes de cada espera.
+"""
+import os
+import sys
+import time
+
+def _stdin_fd():
+    """Descritor do stdin, ou None quando o stdin não tem um descritor real (IDE)."""
+    try:
+        return sys.stdin.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def _answer(res, default):
+    res = res.strip()
+    return res if res else default
+
+def _timed_out(default):
+    print(f"\n[TIMEOUT] Usando padrão: {default}")
+    return default
+
+try:
+    import msvcrt
+    import ctypes
+    from ctypes import wintypes
+
+    _kernel32 = ctypes.windll.kernel32
+    _WAIT_OBJECT_0 = 0
+    _KEY_EVENT = 0x0001
+
+    class _KEY_EVENT_RECORD(ctypes.Structure):
+        _fields_ = [('bKeyDown', wintypes.BOOL), ('wRepeatCount', wintypes.WORD),
+                    ('wVirtualKeyCode', wintypes.WORD), ('wVirtualScanCode', wintypes.WORD),
+                    ('uChar', wintypes.WCHAR), ('dwControlKeyState', wintypes.DWORD)]
+
+    class _EVENT(ctypes.Union):
+        # KEY_EVENT_RECORD é o maior membro usado; o bloco bruto cobre mouse/foco/resize
+        _fields_ = [('KeyEvent', _KEY_EVENT_RECORD), ('raw', ctypes.c_byte * 16)]
+
+    class _INPUT_RECORD(ctypes.Structure):
+        _fields_ = [('EventType', wintypes.WORD), ('Event', _EVENT)]
+
+    def _console_handle():
+        """Handle do console do Windows para o stdin, ou None (pipe, arquivo, IDE)."""
+        try:
+            handle = msvcrt.get_osfhandle(sys.stdin.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        mode = wintypes.DWORD()
+        return handle if _kernel32.GetConsoleMode(handle, ctypes.byref(mode)) else None
+
+    def _char_pending(handle):
+        """Descarta do início da fila apenas eventos que não são caractere (foco, mouse, key-up);
+        para no primeiro caractere digitado, que fica na fila para o getwche()."""
+        rec, n = _INPUT_RECORD(), wintypes.DWORD()
+        while _kernel32.PeekConsoleInputW(handle, ctypes.byref(rec), 1, ctypes.byref(n)) and n.value:
+            key = rec.Event.KeyEvent
+            if rec.EventType == _KEY_EVENT and key.bKeyDown and key.uChar != '\0':
+                return True
+            # Consome só o evento inspecionado: uma tecla que chegue agora fica atrás dele
+            _kernel32.ReadConsoleInputW(handle, ctypes.byref(rec), 1, ctypes.byref(n))
+        return False
+
+    def input_timeout(prompt, timeout=10, default=''):
+        print(f"{prompt} [Automático em {timeout}s]: ", end='', flush=True)
+        handle = _console_handle()
+        if handle is None:
+            # stdin redirecionado: a resposta já está no pipe/arquivo (ou EOF)
+            return _answer(sys.stdin.readline(), default)
+        _kernel32.FlushConsoleInputBuffer(handle)  # digitação de um prompt anterior não vale aqui
+        deadline = time.monotonic() + timeout
+        while not _char_pending(handle):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or _kernel32.WaitForSingleObject(handle, int(remaining * 1000)) != _WAIT_OBJECT_0:
+                return _timed_out(default)
+        # Começou a digitar: sem timeout até o Enter (regra da v8.2)
+        input_chars = []
+        char = msvcrt.getwche()
+        while char != '\r':
+            input_chars.append(char)
+            char = msvcrt.getwche()
+        print()
+        return _answer("".join(input_chars), default)
+
+except ImportError:
+    import select
+    import termios
+
+    # Bytes já lidos do descritor e ainda não entregues (pipe pode trazer várias respostas de uma vez).
+    # A leitura vai direto no fd: o buffer do sys.stdin ficaria invisível para o select().
+    _pending = bytearray()
+
+    def _read_line(fd, timeout=None):
+        """Próxima linha do fd até o prazo (None = sem prazo); None no timeout, '' no EOF sem dados."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b'\n' not in _pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and (remaining <= 0 or not select.select([fd], [], [], remaining)[0]):
+                return None
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            _pending.extend(chunk)
+        line, _, rest = bytes(_pending).partition(b'\n')
+        _pending[:] = rest
+        return line.decode(sys.stdin.encoding or 'utf-8', errors='replace')
+
+    def _first_key(fd, timeout):
+        """Terminal: espera a primeira tecla (não a linha inteira) sem consumi-la. O modo não canônico
+        vale só durante o select(); de volta ao canônico, a tecla segue editável na linha."""
+        saved = termios.tcgetattr(fd)
+        raw = termios.tcgetattr(fd)
+        raw[3] &= ~termios.ICANON
+        raw[6][termios.VMIN], raw[6][termios.VTIME] = 1, 0
+        termios.tcsetattr(fd, termios.TCSANOW, raw)
+        try:
+            return bool(select.select([fd], [], [], timeout)[0])
+        finally:
+            termios.tcsetattr(fd, termios.TCSANOW, saved)
+
+    def input_timeout(prompt, timeout=10, default=''):
+        print(f"{prompt} [Automático em {timeout}s]: ", end='', flush=True)
+        fd = _stdin_fd()
+        if fd is None:
+            return _answer(sys.stdin.readline(), default)
+        if os.isatty(fd):
+            # Descarta o que foi digitado depois do timeout de um prompt anterior
+            termios.tcflush(fd, termios.TCIFLUSH)
+            _pending.clear()
+            if not _first_key(fd, timeout):
+                return _timed_out(default)
+            # Começou a digitar: sem timeout até o Enter (regra da v8.2)
+            res = _read_line(fd)
+        else:
+            # Pipe/arquivo: não descarta nada (as respostas seguintes já vêm nele)
+            res = _read_line(fd, timeout)
+        if res is None:
+            return _timed_out(default)
+        return _answer(res, default)
@@ -0,0 +1,93 @@
+"""
+MODULE:      Agregação por Grupo (kernel compartilhado)
+FILE:        src/ind/lib/groupstats.py
+DESCRIPTION: Somas por grupo (UF, região, estrato) numa única passada sobre um lote de linhas.
+             Usado pelos extratores PISA/SAEB/ENEM; numba é opcional (sem ele, np.bincount).
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange, get_num_threads
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Camadas do acumulador devolvido por group_moments (eixo 0)
+SUM, COUNT, WSUM, WEIGHT, SUMSQ = range(5)
+
+_NO_WEIGHTS = np.empty(0)
+
+def _group_moments_numpy(codes, vals, w, nbins, complete):
+    """Mesmo resultado do kernel via np.bincount (fallback quando o numba não está instalado)."""
+    valid = ~np.isnan(vals)
+    keep = codes >= 0
+    if complete:
+        keep &= valid.all(axis=1)
+    k, vals, valid = codes[keep], vals[keep], valid[keep]
+    wts = np.nan_to_num(w[keep]).astype(np.float64) if w.size else None
+    acc = np.zeros((5, nbins, vals.shape[1]))
+    for j in range(vals.shape[1]):
+        kj, xj = k[valid[:, j]], vals[valid[:, j], j].astype(np.float64)
+        acc[SUM, :, j] = np.bincount(kj, weights=xj, minlength=nbins)
+        acc[COUNT, :, j] = np.bincount(kj, minlength=nbins)
+        acc[SUMSQ, :, j] = np.bincount(kj, weights=xj * xj, minlength=nbins)
+        if wts is not None:
+            wj = wts[valid[:, j]]
+            acc[WSUM, :, j] = np.bincount(kj, weights=xj * wj, minlength=nbins)
+            acc[WEIGHT, :, j] = np.bincount(kj, weights=wj, minlength=nbins)
+    return np.bincount(k, minlength=nbins), acc
+
+if HAS_NUMBA:
+    @njit(parallel=True, cache=True)
+    def _group_moments_jit(codes, vals, w, nbins, complete, nthreads):
+        """Kernel de group_moments; cada thread acumula um bloco disjunto de linhas."""
+        n, m = vals.shape
+        weighted = w.shape[0] > 0
+        step = (n + nthreads - 1) // nthreads
+        acc = np.zeros((nthreads, 5, nbins, m))
+        rows = np.zeros((nthreads, nbins), np.int64)
+        for t in prange(nthreads):
+            for i in range(t * step, min(n, (t + 1) * step)):
+                g = codes[i]
+                if g < 0:
+                    continue
+                if complete:
+                    skip = False
+                    for j in range(m):
+                        if np.isnan(vals[i, j]):
+                            skip = True
+                            break
+                    if skip:
+                        continue
+                rows[t, g] += 1
+                wi = 0.0
+                if weighted:
+                    wi = np.float64(w[i])
+                    if np.isnan(wi):
+                        wi = 0.0
+                for j in range(m):
+                    v = np.float64(vals[i, j])
+                    if np.isnan(v):
+                        continue
+                    acc[t, SUM, g, j] += v
+                    acc[t, COUNT, g, j] += 1.0
+                    acc[t, SUMSQ, g, j] += v * v
+                    if weighted:
+                        acc[t, WSUM, g, j] += v * wi
+                        acc[t, WEIGHT, g, j] += wi
+        return rows.sum(axis=0), acc.sum(axis=0)
+
+def group_moments(codes, vals, nbins, weights=None, complete=False):
+    """
+    Somas por grupo de uma matriz de valores (linhas x colunas) numa única passada.
+
+    codes: posição do grupo por linha (< 0 = linha ignorada). Células NaN não entram nas somas
+    da sua coluna; com complete=True, a linha com qualquer NaN é ignorada inteira. Peso NaN vale 0.
+    Retorna (linhas por grupo, acumulador [SUM, COUNT, WSUM, WEIGHT, SUMSQ] x grupo x coluna);
+    sem weights, as camadas WSUM e WEIGHT ficam zeradas.
+    """
+    w = _NO_WEIGHTS if weights is None else weights
+    if HAS_NUMBA:
+        # nthreads vem de fora do kernel: get_num_threads() dentro dele impede o cache em disco
+        return _group_moments_jit(codes, vals, w, nbins, complete, get_num_threads())
+    return _group_moments_numpy(codes, vals, w, nbins, complete)
@@ -16,12 +16,15 @@ class DataGuard:
 
     def check_range(self, columns, min_val, max_val):
         """Verifica se valores numéricos estão dentro da escala esperada (ex: 0-1000)."""
-        for col in columns:
-            if col in self.df.columns:
-                vmin = self.df[col].min()
-                vmax = self.df[col].max()
-                if vmin < min_val or vmax > max_val:
-                    self.errors.append(f"[RANGE] {col} fora dos limites: Min={vmin}, Max={vmax} (Esperado: {min_val}-{max_val})")
+        cols = [c for c in columns if c in self.df.columns]
+        if not cols:
+            return
+        # Mín/máx de todas as colunas numa única redução
+        vmins = self.df[cols].min()
+        vmaxs = self.df[cols].max()
+        fora = (vmins < min_val) | (vmaxs > max_val)
+        for col in fora.index[fora]:
+            self.errors.append(f"[RANGE] {col} fora dos limites: Min={vmins[col]}, Max={vmaxs[col]} (Esperado: {min_val}-{max_val})")
     
     def check_historical_consistency(self, score_col, uf_col='UF'):
         """